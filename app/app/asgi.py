@@ -10,7 +10,16 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from django.db import DatabaseError
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_asgi_application()
+
+from losb.api.v1.services.user_filter import known_users  # noqa: E402, needs the apps loaded
+
+try:
+    known_users.warm_up()
+except DatabaseError:
+    # tokens go on to the user lookup until rebuild-user-filter publishes a filter
+    pass
@@ -12,6 +12,10 @@ class PhoneAlreadyVerified(APIException):
     status_code = 409
     default_detail = 'Trying to verify already registered phone number.'
 
+class PhoneAlreadyInUse(APIException):
+    status_code = 409
+    default_detail = 'This phone number is already registered to another account.'
+
 class SmsVerificationResendCooldown(APIException):
     status_code = 403
     default_detail = f'You must wait for N seconds before requesting a new SMS verification code.' # TDOO update message
@@ -33,6 +37,15 @@ class SmsVerificationFailed(APIException):
     status_code = 403
     default_detail = 'Sms verification failed'
 
+class IdempotencyKeyReused(APIException):
+    status_code = 422
+    default_detail = 'Idempotency-Key was already used for a different request.'
+
+class IdempotentRequestInProgress(APIException):
+    status_code = 409
+    default_detail = 'A request with this Idempotency-Key is still being processed, retry later.'
+
 class SmsDeliveryError(APIException):
     def __init__(self, default_detail):
-        self.default_detail = default_detail
\ No newline at end of file
+        self.default_detail = default_detail
+        super().__init__()
\ No newline at end of file
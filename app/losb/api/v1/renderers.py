@@ -0,0 +1,17 @@
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import json
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class JSONLinesRenderer(BaseRenderer):
+    """
+    JSON lines: one JSON document per line, a list renders one line per item.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(item, cls=JSONEncoder, ensure_ascii=False) + '\n' for item in items).encode()
@@ -1,22 +1,71 @@
 from rest_framework import serializers
-from losb.models import User, City, Phone, SMSVerification
+from app import settings
+from losb.api.v1.services.phone_numbers import InvalidPhoneNumber, parse_phone
+from losb.models import User, City, CityChange, SMSVerification, SmsOutbox, SmsDeliveryReport
 
 
 class PhoneSerializer(serializers.ModelSerializer):
+    code = serializers.CharField(source='phone_code')
+    number = serializers.CharField(source='phone_number', allow_null=True, required=False)
+
     class Meta:
-        model = Phone
+        model = User
         fields = ('code', 'number')
 
+    def validate(self, attrs):
+        try:
+            phone = parse_phone(attrs.get('phone_code', ''), attrs.get('phone_number'))
+        except InvalidPhoneNumber as e:
+            raise serializers.ValidationError({'number': str(e)})
+        return {**attrs, 'phone_code': phone.code, 'phone_number': phone.number, 'phone_e164': phone.e164}
+
+    def update(self, instance, validated_data):
+        # only the phone columns, a full save would overwrite concurrent profile edits
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
 
 class CitySerializer(serializers.ModelSerializer):
     class Meta:
         model = City
-        fields = ('name',)
+        fields = ('id', 'name')
+
+
+class CityChangeSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='city_id')
+
+    class Meta:
+        model = CityChange
+        fields = ('id', 'name', 'action')
+
+
+class CityDeltaQuerySerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0, required=False)
+
+
+class CitySearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=255)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
+class CityNearestQuerySerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lon = serializers.FloatField(min_value=-180, max_value=180)
+    limit = serializers.IntegerField(min_value=1, max_value=10, default=1)
+
+
+class CityDistanceSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    distance_km = serializers.FloatField()
 
 
 class UserSerializer(serializers.ModelSerializer):
-    city = CitySerializer()
-    phone = PhoneSerializer()
+    avatar = serializers.ImageField(source='avatar_url')
+    city = CitySerializer(source='location')
+    phone = PhoneSerializer(source='*')
 
     class Meta:
         model = User
@@ -30,6 +79,8 @@ class UserNameSerializer(serializers.ModelSerializer):
 
 
 class UserCitySerializer(serializers.ModelSerializer):
+    city = serializers.PrimaryKeyRelatedField(source='location', queryset=City.objects.all())
+
     class Meta:
         model = User
         fields = ('city',)
@@ -41,12 +92,11 @@ class UserBirthdaySerializer(serializers.ModelSerializer):
         fields = ('birthday',)
 
 
-class UserPhoneSerializer(serializers.ModelSerializer):
-    number = serializers.CharField()
+class UserPhoneSerializer(PhoneSerializer):
+    number = serializers.CharField(source='phone_number')
 
-    class Meta:
-        model = Phone
-        fields = ('code', 'number')
+    class Meta(PhoneSerializer.Meta):
+        pass
 
 
 class SMSVerificationSerializer(serializers.ModelSerializer):
@@ -55,6 +105,25 @@ class SMSVerificationSerializer(serializers.ModelSerializer):
         fields = ('otp',)
 
 
+class SmsDeliveryStatusSerializer(serializers.ModelSerializer):
+    delivery_status = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SmsOutbox
+        fields = ('status', 'attempts', 'updated_at', 'delivery_status')
+
+    def get_delivery_status(self, obj) -> str | None:
+        if not obj.provider_message_id:
+            return None
+        report = SmsDeliveryReport.objects.filter(provider_message_id=obj.provider_message_id).first()
+        if report is None:
+            return None
+        try:
+            return SmsDeliveryReport.Status(report.status_code).name.lower()
+        except ValueError:
+            return str(report.status_code)
+
+
 class UserPhoneVerificationSerializer(serializers.ModelSerializer):
     phone = PhoneSerializer()
 
@@ -63,5 +132,42 @@ class UserPhoneVerificationSerializer(serializers.ModelSerializer):
         fields = ('otp', 'phone')
 
 
+class UserProvisionSerializer(serializers.Serializer):
+    telegram_ids = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        min_length=1,
+        max_length=settings.USER_PROVISION_MAX_BATCH,
+    )
+
+
+class UserLookupSerializer(serializers.Serializer):
+    telegram_ids = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        min_length=1,
+        max_length=settings.USER_LOOKUP_MAX_BATCH,
+    )
+
+
+class UserProvisionResultSerializer(serializers.Serializer):
+    created = serializers.ListField(child=serializers.CharField())
+    existing = serializers.ListField(child=serializers.CharField())
+
+
 class BotUrlSerializer(serializers.Serializer):
     url = serializers.CharField()
+
+
+class BootstrapQuerySerializer(serializers.Serializer):
+    cities_etag = serializers.CharField(required=False)
+
+
+class CityCatalogueStateSerializer(serializers.Serializer):
+    version = serializers.IntegerField()
+    etag = serializers.CharField()
+    items = CitySerializer(many=True, allow_null=True)
+
+
+class BootstrapSerializer(serializers.Serializer):
+    user = UserSerializer()
+    tech_support = BotUrlSerializer()
+    cities = CityCatalogueStateSerializer()
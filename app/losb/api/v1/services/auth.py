@@ -1,12 +1,17 @@
+import hmac
 from typing import Optional
 
 import jwt
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
-from rest_framework import authentication
+from rest_framework import authentication, permissions
 from rest_framework.exceptions import AuthenticationFailed
 
-from app.settings import SECRET_KEY
+from app.settings import INTERNAL_SERVICE_TOKEN, SECRET_KEY
+from losb.db_router import route_user_reads
+from losb.api.v1.services.profile_cache import profile_cache
+from losb.api.v1.services.user_cache import user_cache
+from losb.api.v1.services.user_filter import known_users
 
 class TokenError(Exception):
     pass
@@ -57,10 +62,46 @@ class ExampleAuthentication(authentication.BaseAuthentication):
         except InvalidTokenError as ex:
             raise TokenError(_("Token is invalid or expired")) from ex
 
-        try:
-            User = get_user_model()
-            user = User.objects.get(telegram_id=decoded_token.get('telegram_id'))
-        except User.DoesNotExist:
+        telegram_id = decoded_token.get('telegram_id')
+        if not known_users.might_exist(telegram_id):
             raise AuthenticationFailed('No such user')
+        route_user_reads(telegram_id)
+
+        projection = self.get_projection(request)
+        version = profile_cache.get_version(telegram_id)
+        user = user_cache.get(telegram_id, version, projection)
+        if user is not None:
+            return user, None
+
+        generation = user_cache.generation
+        user = profile_cache.get_user(telegram_id, version, projection)
+        if user is None:
+            try:
+                User = get_user_model()
+                user = User.objects.projected(projection).get(telegram_id=telegram_id)
+            except User.DoesNotExist:
+                raise AuthenticationFailed('No such user')
+            profile_cache.set_user(telegram_id, version, user, projection)
 
+        user_cache.set(telegram_id, user, generation, version, projection)
         return user, None
+
+    @staticmethod
+    def get_projection(request) -> str:
+        """
+        Query shape declared by the view as ``user_projection``, see
+        ``CustomUserManager.PROJECTIONS``. Fields outside of it are loaded lazily.
+        """
+        view = (request.parser_context or {}).get('view')
+        return getattr(view, 'user_projection', 'full')
+
+
+class IsInternalService(permissions.BasePermission):
+    """
+    Internal callers send the shared ``INTERNAL_SERVICE_TOKEN`` in the
+    ``X-Service-Token`` header; without a configured token nobody passes.
+    """
+
+    def has_permission(self, request, view):
+        token = request.headers.get('X-Service-Token', '')
+        return bool(INTERNAL_SERVICE_TOKEN) and hmac.compare_digest(token.encode(), INTERNAL_SERVICE_TOKEN.encode())
@@ -0,0 +1,186 @@
+import gzip
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import DateTimeField, ExpressionWrapper
+from django.db.models.functions import Now
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+from losb.api.v1.serializers import CityChangeSerializer, CitySerializer
+from losb.api.v1.services.counters import bump_counter, get_counters
+from losb.models import City, CityChange
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+@dataclass(frozen=True)
+class CitySnapshot:
+    version: int
+    dataset_version: int
+    etag: str
+    data: list
+    payload: bytes
+    sync_payload: bytes
+    encoded: dict[str, bytes] = field(default_factory=dict)
+
+    def etag_for(self, encoding) -> str:
+        """
+        Every content coding is a different representation, so it gets its own strong ETag.
+        """
+        return f'{self.etag[:-1]}-{encoding}"' if encoding else self.etag
+
+    def has_etag(self, etag) -> bool:
+        return etag in {self.etag_for(encoding) for encoding in (None, *self.encoded)}
+
+
+class CityCatalogue:
+    """
+    Pre-rendered city list shared by every request of the process.
+
+    The JSON payload, its content-hash ETag and compressed variants are built
+    once per catalogue version. The version lives in ``CACHES`` so City edits
+    and ``populate-cities`` runs in other processes reach every worker.
+
+    Separately, the dataset version is the id of the latest settled
+    ``CityChange``; clients pass it back as ``since`` to receive only the
+    changes after it. Ids are taken at insert, not at commit, so a change
+    younger than ``settle`` seconds may still have an uncommitted one with a
+    lower id before it: such changes are not counted in the version yet.
+    Transactions writing cities must therefore be shorter than ``settle``.
+    """
+    VERSION_KEY = 'losb:cities:version'
+
+    def __init__(self, alias: str, max_delta: int, settle: float):
+        self.alias = alias
+        self.max_delta = max_delta
+        self.settle = settle
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_version(self) -> int:
+        version, = get_counters(self.cache, self.VERSION_KEY)
+        return version
+
+    def get_snapshot(self) -> CitySnapshot:
+        version = self.get_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self._build(version)
+            return self._snapshot
+
+    def invalidate(self):
+        bump_counter(self.cache, self.VERSION_KEY)
+
+    def response(self, request) -> HttpResponse:
+        snapshot = self.get_snapshot()
+        encoding = self._pick_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), snapshot)
+        etag = snapshot.etag_for(encoding)
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(snapshot.encoded.get(encoding, snapshot.payload), content_type='application/json')
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding, Authorization'
+        response['Cache-Control'] = 'private, no-cache'
+        response['X-Catalogue-Version'] = snapshot.dataset_version
+        return response
+
+    def delta_response(self, since: int) -> HttpResponse:
+        """
+        Changes after dataset version ``since``, or the full snapshot when the
+        client has nothing yet, is ahead of us or is too far behind.
+        """
+        snapshot = self.get_snapshot()
+        # the snapshot keeps the version it was built with, changes settled since then count too
+        dataset_version = self.get_dataset_version()
+        if since <= 0 or since > dataset_version:
+            return self._sync_response(snapshot.sync_payload, snapshot.dataset_version)
+
+        changes = []
+        if since < dataset_version:
+            changes = list(
+                CityChange.objects
+                .filter(id__gt=since, id__lte=dataset_version)
+                .order_by('id')[:self.max_delta + 1]
+            )
+            if len(changes) > self.max_delta:
+                return self._sync_response(snapshot.sync_payload, snapshot.dataset_version)
+
+        payload = JSONRenderer().render({
+            'version': dataset_version,
+            'full': False,
+            'changes': CityChangeSerializer(changes, many=True).data,
+        })
+        return self._sync_response(payload, dataset_version)
+
+    def get_dataset_version(self) -> int:
+        # CityChange.created_at comes from the database clock, so does the cutoff
+        settled = ExpressionWrapper(Now() - timedelta(seconds=self.settle), output_field=DateTimeField())
+        latest = CityChange.objects.filter(created_at__lte=settled).order_by('-id').values_list('id', flat=True)
+        return latest.first() or 0
+
+    @staticmethod
+    def _sync_response(payload: bytes, dataset_version: int) -> HttpResponse:
+        response = HttpResponse(payload, content_type='application/json')
+        response['X-Catalogue-Version'] = dataset_version
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _build(self, version: int) -> CitySnapshot:
+        # read the dataset version first: cities changed in between are sent again, never skipped
+        dataset_version = self.get_dataset_version()
+        data = CitySerializer(City.objects.order_by('pk'), many=True).data
+        payload = JSONRenderer().render(data)
+        encoded = {'gzip': gzip.compress(payload, compresslevel=9)}
+        if brotli is not None:
+            encoded['br'] = brotli.compress(payload)
+        etag = f'"{hashlib.sha256(payload).hexdigest()[:32]}"'
+        sync_payload = b'{"version":%d,"full":true,"cities":%s}' % (dataset_version, payload)
+        return CitySnapshot(
+            version=version,
+            dataset_version=dataset_version,
+            etag=etag,
+            data=data,
+            payload=payload,
+            sync_payload=sync_payload,
+            encoded=encoded,
+        )
+
+    @staticmethod
+    def _pick_encoding(accept_encoding: str, snapshot: CitySnapshot):
+        accepted = set()
+        for item in accept_encoding.split(','):
+            coding, _, params = item.strip().partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.add(coding.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in snapshot.encoded:
+                return encoding
+        return None
+
+
+city_catalogue = CityCatalogue(
+    alias=settings.CITY_CATALOGUE_CACHE_ALIAS,
+    max_delta=settings.CITY_CATALOGUE_MAX_DELTA,
+    settle=settings.CITY_CATALOGUE_SETTLE_SECONDS,
+)
@@ -0,0 +1,127 @@
+import heapq
+import math
+import threading
+
+from losb.api.v1.services.city_catalogue import city_catalogue
+from losb.models import City
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_unit_vector(latitude: float, longitude: float) -> tuple[float, float, float]:
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+
+def chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+class CityKDTree:
+    """
+    Static 3-d tree over cities projected onto the unit sphere.
+
+    Working with unit vectors instead of raw degrees keeps distances correct
+    across the antimeridian and near the poles: the straight-line (chord)
+    distance between two vectors grows monotonically with the great-circle
+    distance, so the nearest chord is the nearest city.
+    """
+
+    def __init__(self, cities):
+        self.cities = []
+        points = []
+        for pk, name, latitude, longitude in cities:
+            self.cities.append((pk, name))
+            points.append(to_unit_vector(latitude, longitude))
+        self._points = points
+        # node arrays: point index, split axis, left and right child (-1 for none)
+        self._index, self._axis, self._left, self._right = [], [], [], []
+        self._root = self._build(list(range(len(points))), 0)
+
+    def __len__(self):
+        return len(self.cities)
+
+    def _build(self, indices, depth) -> int:
+        if not indices:
+            return -1
+        axis = depth % 3
+        indices.sort(key=lambda i: self._points[i][axis])
+        median = len(indices) // 2
+        node = len(self._index)
+        self._index.append(indices[median])
+        self._axis.append(axis)
+        self._left.append(-1)
+        self._right.append(-1)
+        self._left[node] = self._build(indices[:median], depth + 1)
+        self._right[node] = self._build(indices[median + 1:], depth + 1)
+        return node
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1) -> list[tuple[int, str, float]]:
+        """
+        Up to ``k`` closest cities as (pk, name, distance in km), closest first.
+        """
+        if self._root < 0:
+            return []
+        target = to_unit_vector(latitude, longitude)
+        points, index, axes, left, right = self._points, self._index, self._axis, self._left, self._right
+        best = []  # max-heap of (-squared distance, point index)
+        # nodes to visit with a lower bound of the squared distance to anything below them
+        stack = [(self._root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+            point_idx = index[node]
+            point = points[point_idx]
+            dx, dy, dz = point[0] - target[0], point[1] - target[1], point[2] - target[2]
+            distance = dx * dx + dy * dy + dz * dz
+            if len(best) < k:
+                heapq.heappush(best, (-distance, point_idx))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, point_idx))
+
+            diff = target[axes[node]] - point[axes[node]]
+            near, far = (left[node], right[node]) if diff < 0 else (right[node], left[node])
+            # the far side is pushed first so the near side is explored first
+            if far >= 0:
+                stack.append((far, max(bound, diff * diff)))
+            if near >= 0:
+                stack.append((near, bound))
+
+        return [
+            (*self.cities[point_idx], chord_to_km(math.sqrt(-distance)))
+            for distance, point_idx in sorted(best, reverse=True)
+        ]
+
+
+class CityNearest:
+    """
+    Per-process holder of the CityKDTree, rebuilt whenever the city catalogue
+    version moves.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._tree = None
+        self._lock = threading.Lock()
+
+    def get_tree(self) -> CityKDTree:
+        version = city_catalogue.get_version()
+        if self._tree is not None and self._version == version:
+            return self._tree
+
+        with self._lock:
+            if self._tree is None or self._version != version:
+                self._tree = CityKDTree(
+                    City.objects
+                    .filter(latitude__isnull=False, longitude__isnull=False)
+                    .values_list('pk', 'name', 'latitude', 'longitude')
+                )
+                self._version = version
+            return self._tree
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1) -> list[tuple[int, str, float]]:
+        return self.get_tree().nearest(latitude, longitude, k)
+
+
+city_nearest = CityNearest()
@@ -0,0 +1,149 @@
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+
+from losb.api.v1.services.city_catalogue import city_catalogue
+from losb.models import City
+
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'iu', 'я': 'ia',
+}
+# spellings people use interchangeably when typing Russian names in Latin
+LATIN_FOLDS = (('kh', 'h'), ('ck', 'k'), ('x', 'ks'), ('w', 'v'), ('y', 'i'), ('j', 'i'))
+
+CYRILLIC = re.compile('[а-я]')
+SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(text: str) -> str:
+    """
+    Case-folded, ё-less, punctuation-free form of a city name or query.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    return SEPARATORS.sub(' ', text).strip()
+
+
+def to_latin(text: str) -> str:
+    """
+    Latin key of a normalized string: Cyrillic is transliterated, then common
+    alternative Latin spellings are folded together.
+    """
+    text = ''.join(CYRILLIC_TO_LATIN.get(char, char) for char in text)
+    for source, target in LATIN_FOLDS:
+        text = text.replace(source, target)
+    return text
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CityIndex:
+    """
+    Immutable search index over city names.
+
+    Prefixes are answered by binary search over a sorted array of name
+    suffixes starting at each word, which is the flat equivalent of a prefix
+    trie. When nothing matches by prefix (typically a typo), trigram postings
+    rank fuzzy matches by Dice similarity. Names are indexed both as normalized Cyrillic and as a
+    transliterated Latin key, and the query picks the matching script.
+    """
+    FUZZY_THRESHOLD = 0.35
+    # bounds the work for one- and two-letter queries that prefix most of the catalogue
+    MAX_PREFIX_MATCHES = 2000
+
+    def __init__(self, cities):
+        self.cities = []
+        self._keys = {'cyrillic': [], 'latin': []}
+        self._prefixes = {'cyrillic': [], 'latin': []}
+        self._trigrams = {'cyrillic': {}, 'latin': {}}
+        self._trigram_counts = {'cyrillic': [], 'latin': []}
+
+        for idx, (pk, name) in enumerate(cities):
+            self.cities.append((pk, name))
+            cyrillic = normalize(name)
+            for script, key in (('cyrillic', cyrillic), ('latin', to_latin(cyrillic))):
+                self._keys[script].append(key)
+                # word_rank 0 marks a match at the start of the full name
+                for word_rank, start in enumerate(m.start() for m in re.finditer(r'\S+', key)):
+                    self._prefixes[script].append((key[start:], min(word_rank, 1), idx))
+                postings = self._trigrams[script]
+                key_trigrams = trigrams(key)
+                self._trigram_counts[script].append(len(key_trigrams))
+                for trigram in key_trigrams:
+                    postings.setdefault(trigram, []).append(idx)
+
+        for prefixes in self._prefixes.values():
+            prefixes.sort()
+
+    def __len__(self):
+        return len(self.cities)
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[int, str]]:
+        query = normalize(query)
+        if not query:
+            return []
+        script = 'cyrillic' if CYRILLIC.search(query) else 'latin'
+        if script == 'latin':
+            query = to_latin(query)
+        keys = self._keys[script]
+
+        ranked = {}
+        prefixes = self._prefixes[script]
+        position = bisect_left(prefixes, (query,))
+        end = min(len(prefixes), position + self.MAX_PREFIX_MATCHES)
+        while position < end and prefixes[position][0].startswith(query):
+            _, word_rank, idx = prefixes[position]
+            rank = (0 if keys[idx] == query else 1 + word_rank, 0.0)
+            if idx not in ranked or rank < ranked[idx]:
+                ranked[idx] = rank
+            position += 1
+
+        if not ranked:
+            query_trigrams = trigrams(query)
+            postings = self._trigrams[script]
+            counts = self._trigram_counts[script]
+            shared = Counter(chain.from_iterable(postings.get(trigram, ()) for trigram in query_trigrams))
+            for idx, common in shared.items():
+                score = 2 * common / (len(query_trigrams) + counts[idx])
+                if score >= self.FUZZY_THRESHOLD:
+                    ranked[idx] = (3, -score)
+
+        best = sorted(ranked, key=lambda idx: (ranked[idx], len(keys[idx]), keys[idx]))[:limit]
+        return [self.cities[idx] for idx in best]
+
+
+class CitySearch:
+    """
+    Per-process holder of the CityIndex, rebuilt whenever the city catalogue
+    version moves.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get_index(self) -> CityIndex:
+        version = city_catalogue.get_version()
+        if self._index is not None and self._version == version:
+            return self._index
+
+        with self._lock:
+            if self._index is None or self._version != version:
+                self._index = CityIndex(City.objects.order_by('pk').values_list('pk', 'name'))
+                self._version = version
+            return self._index
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[int, str]]:
+        return self.get_index().search(query, limit)
+
+
+city_search = CitySearch()
@@ -0,0 +1,36 @@
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def get_counters(cache, *keys) -> list[int]:
+    """
+    Read shared version counters in a single round-trip, seeding missing ones.
+
+    Counters are seeded with a timestamp rather than 0, so an evicted counter
+    never falls back onto a value whose cached data is still around.
+    """
+    values = cache.get_many(keys)
+    return [values[key] if values.get(key) is not None else _seed_counter(cache, key) for key in keys]
+
+
+def bump_counter(cache, key: str):
+    try:
+        cache.incr(key)
+    except ValueError:
+        _seed_counter(cache, key)
+
+
+def _seed_counter(cache, key: str) -> int:
+    value = time.time_ns()
+    cache.add(key, value, timeout=None)
+    return cache.get(key, value)
+
+
+def is_process_local(alias: str) -> bool:
+    """
+    Whether the cache alias lives in the memory of this process (LocMemCache),
+    so keys and counters set there are invisible to other workers.
+    """
+    return isinstance(caches[alias], LocMemCache)
@@ -0,0 +1,101 @@
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class LatencyMetrics:
+    """
+    Per-attempt latency and outcome counters of an outgoing HTTP client.
+
+    Keeps totals plus a bounded window of recent latencies for percentiles.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.attempts = 0
+        self.failures = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool, retry: bool = False):
+        with self._lock:
+            self.attempts += 1
+            self.failures += not ok
+            self.retries += retry
+            self.total_seconds += seconds
+            self._recent.append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            recent = sorted(self._recent)
+            return {
+                'attempts': self.attempts,
+                'failures': self.failures,
+                'retries': self.retries,
+                'mean_ms': self.total_seconds / self.attempts * 1000 if self.attempts else 0.0,
+                'p50_ms': recent[len(recent) // 2] * 1000 if recent else 0.0,
+                'p99_ms': recent[int(len(recent) * 0.99)] * 1000 if recent else 0.0,
+            }
+
+
+class PooledHttpClient:
+    """
+    Process-wide keep-alive HTTP client with timeouts and bounded retries.
+
+    Connection errors (including connect timeouts) and 5xx answers are retried
+    with full-jitter exponential backoff. Read timeouts are not retried: the
+    request may already have been processed by the remote side.
+    """
+    RETRY_STATUSES = frozenset(range(500, 600))
+
+    def __init__(self, pool_size: int, connect_timeout: float, read_timeout: float,
+                 max_retries: int, backoff: float):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.metrics = LatencyMetrics()
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def get(self, url: str, params=None) -> requests.Response:
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.ConnectionError:
+                retry = attempt < self.max_retries
+                self.metrics.record(time.perf_counter() - started, ok=False, retry=retry)
+                if not retry:
+                    raise
+            except requests.RequestException:
+                self.metrics.record(time.perf_counter() - started, ok=False)
+                raise
+            else:
+                failed = response.status_code in self.RETRY_STATUSES
+                retry = failed and attempt < self.max_retries
+                self.metrics.record(time.perf_counter() - started, ok=not failed, retry=retry)
+                if not retry:
+                    return response
+                response.close()
+
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from losb.api.v1 import exceptions
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotentRequests:
+    """
+    Replays the first successful response to requests repeating an ``Idempotency-Key``.
+
+    Entries are keyed by user and key and hold a fingerprint of the request
+    body, so a key reused for a different body is rejected. The first request
+    claims the key with ``cache.add``; duplicates arriving while it runs poll
+    for its response for up to ``wait`` seconds. Error responses release the
+    key so the client can retry.
+    """
+    PENDING = 'pending'
+
+    def __init__(self, alias: str, ttl: int, lock_timeout: int, wait: float, poll_interval: float = 0.05):
+        self.alias = alias
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def get_key(request):
+        key = request.headers.get(HEADER)
+        if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+            raise ValidationError({HEADER: f'Must be 1 to {MAX_KEY_LENGTH} characters long.'})
+        return key
+
+    @staticmethod
+    def _cache_key(request, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f'losb:idempotency:{request.user.pk}:{request.method}:{request.path}:{digest}'
+
+    @staticmethod
+    def _fingerprint(request) -> str:
+        return hashlib.sha256(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def is_repeated(self, request) -> bool:
+        """
+        Whether the key was already claimed, by a finished or an in-flight request.
+        """
+        key = self.get_key(request)
+        return key is not None and self.cache.get(self._cache_key(request, key)) is not None
+
+    def respond(self, request, handler) -> Response:
+        key = self.get_key(request)
+        if key is None:
+            return handler()
+
+        cache_key = self._cache_key(request, key)
+        fingerprint = self._fingerprint(request)
+        if self.cache.add(cache_key, (self.PENDING, fingerprint), timeout=self.lock_timeout):
+            return self._run(cache_key, fingerprint, handler)
+
+        deadline = time.monotonic() + self.wait
+        while True:
+            entry = self.cache.get(cache_key)
+            if entry is None:
+                # the first request failed and released the key, this one takes over
+                if self.cache.add(cache_key, (self.PENDING, fingerprint), timeout=self.lock_timeout):
+                    return self._run(cache_key, fingerprint, handler)
+                # another duplicate took it over first, wait for it like for the original
+            else:
+                state, entry_fingerprint, *stored = entry
+                if entry_fingerprint != fingerprint:
+                    raise exceptions.IdempotencyKeyReused()
+                if state != self.PENDING:
+                    status, data = stored
+                    return Response(data, status=status, headers={'Idempotent-Replayed': 'true'})
+            if time.monotonic() >= deadline:
+                raise exceptions.IdempotentRequestInProgress()
+            time.sleep(self.poll_interval)
+
+    def _run(self, cache_key: str, fingerprint: str, handler) -> Response:
+        try:
+            response = handler()
+        except BaseException:
+            self.cache.delete(cache_key)
+            raise
+        if 200 <= response.status_code < 300:
+            self.cache.set(cache_key, ('done', fingerprint, response.status_code, response.data), timeout=self.ttl)
+        else:
+            self.cache.delete(cache_key)
+        return response
+
+
+idempotent_requests = IdempotentRequests(
+    alias=settings.IDEMPOTENCY_CACHE_ALIAS,
+    ttl=settings.IDEMPOTENCY_TTL,
+    lock_timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT,
+    wait=settings.IDEMPOTENCY_WAIT,
+)
@@ -0,0 +1,143 @@
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from losb.api.v1.services.profile_cache import profile_cache
+from losb.api.v1.services.user_cache import user_cache
+from losb.models import SMSVerification, SmsOutbox, User
+
+
+@dataclass
+class JobRun:
+    name: str
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class MaintenanceJob:
+    """
+    Periodic job: ``run(budget, batch_size)`` does at most ``budget`` seconds
+    of work in batches and returns the number of rows it processed.
+    """
+    name: str
+    interval: float
+    run: callable
+    last_run: float = float('-inf')
+
+    def is_due(self, now: float) -> bool:
+        return now - self.last_run >= self.interval
+
+
+class MaintenanceScheduler:
+    """
+    Runs registered jobs whenever their interval has passed, one at a time.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def register(self, name: str, interval: float):
+        def decorator(func):
+            self.jobs[name] = MaintenanceJob(name=name, interval=interval, run=func)
+            return func
+        return decorator
+
+    def run_pending(self, budget: float, batch_size: int, names=None, force: bool = False) -> list[JobRun]:
+        runs = []
+        for job in self.jobs.values():
+            if names and job.name not in names:
+                continue
+            now = time.monotonic()
+            if not force and not job.is_due(now):
+                continue
+            job.last_run = now
+            rows = job.run(budget, batch_size)
+            runs.append(JobRun(name=job.name, rows=rows, seconds=time.monotonic() - now))
+        return runs
+
+    def seconds_until_due(self, names=None) -> float:
+        now = time.monotonic()
+        jobs = [job for job in self.jobs.values() if not names or job.name in names]
+        return max(0.0, min((job.last_run + job.interval - now for job in jobs), default=60.0))
+
+
+maintenance = MaintenanceScheduler()
+
+
+@maintenance.register('purge-expired-verifications', interval=settings.SMS_VERIFICATION_PURGE_INTERVAL)
+def purge_expired_verifications(budget: float, batch_size: int) -> int:
+    """
+    Delete SMSVerification rows older than SMS_VERIFICATION_TTL, oldest first.
+
+    Every batch is its own short transaction that walks the ``created_at``
+    index. The references are cleared with explicit bulk UPDATEs and the rows
+    removed with one DELETE, instead of ``delete()`` and its collector;
+    the owners' cached users and profiles are invalidated here instead.
+    """
+    deadline = time.monotonic() + budget
+    cutoff = timezone.now() - timedelta(seconds=settings.SMS_VERIFICATION_TTL)
+    purged = 0
+    while time.monotonic() < deadline:
+        with transaction.atomic():
+            ids = list(
+                SMSVerification.objects
+                .filter(created_at__lt=cutoff)
+                .order_by('created_at')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            owners = list(User.objects.filter(sms_verification_id__in=ids).values_list('telegram_id', flat=True))
+            User.objects.filter(sms_verification_id__in=ids).update(sms_verification=None)
+            SmsOutbox.objects.filter(verification_id__in=ids).update(verification=None)
+            purged += _delete_rows(SMSVerification, ids)
+            transaction.on_commit(lambda owners=owners: _invalidate_users(owners))
+    return purged
+
+
+def _delete_rows(model, ids) -> int:
+    """
+    One ``DELETE ... WHERE pk IN (ids)``: no collector, no cascades, no signals.
+    The caller has already cleared every reference to the rows.
+    """
+    queryset = model._base_manager.filter(pk__in=ids)
+    return queryset._raw_delete(queryset.db)
+
+
+def _invalidate_users(telegram_ids):
+    for telegram_id in telegram_ids:
+        user_cache.invalidate(telegram_id)
+        profile_cache.bump(telegram_id)
+
+
+@maintenance.register('purge-sms-outbox', interval=settings.SMS_OUTBOX_PURGE_INTERVAL)
+def purge_sms_outbox(budget: float, batch_size: int) -> int:
+    """
+    Delete sent and dead SmsOutbox rows SMS_OUTBOX_RETENTION after they settled.
+
+    Their message holds the plaintext code. Delivery reports are kept apart in
+    SmsDeliveryReport and stay. Batches walk the ``(status, updated_at)`` index.
+    """
+    deadline = time.monotonic() + budget
+    cutoff = timezone.now() - timedelta(seconds=settings.SMS_OUTBOX_RETENTION)
+    purged = 0
+    while time.monotonic() < deadline:
+        ids = list(
+            SmsOutbox.objects
+            .filter(status__in=[SmsOutbox.Status.SENT, SmsOutbox.Status.DEAD], updated_at__lt=cutoff)
+            .order_by('updated_at')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        purged += SmsOutbox.objects.filter(pk__in=ids).delete()[0]
+    return purged
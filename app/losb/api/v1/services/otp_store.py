@@ -0,0 +1,180 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from losb.models import SMSVerification, SmsOutbox
+
+
+@dataclass(frozen=True)
+class OtpRecord:
+    otp: str
+    attempts: int
+    created_at: datetime
+
+    @property
+    def age(self) -> timedelta:
+        return timezone.now() - self.created_at
+
+
+class OtpStore(ABC):
+    """
+    Storage of the pending phone verification code of a user.
+
+    ``create`` replaces any previous code and links it to the outbox row that
+    delivers it. A guess first takes one of the ``limit`` attempts with
+    ``reserve_attempt`` and is then checked by ``consume``, which deletes the
+    code only if it matches. Both are single atomic operations, so concurrent
+    guesses can neither exceed the limit nor consume the same code twice.
+    """
+    ttl = None
+
+    @abstractmethod
+    def get(self, user) -> OtpRecord | None:
+        ...
+
+    @abstractmethod
+    def create(self, user, otp: str, outbox: SmsOutbox) -> OtpRecord:
+        ...
+
+    @abstractmethod
+    def reserve_attempt(self, user, limit: int) -> bool:
+        ...
+
+    @abstractmethod
+    def consume(self, user, otp: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, user):
+        ...
+
+    @abstractmethod
+    def get_outbox(self, user) -> SmsOutbox | None:
+        ...
+
+
+class CacheOtpStore(OtpStore):
+    """
+    Codes kept in ``CACHES`` with a native TTL: nothing is written to the database.
+
+    The attempts counter is a separate key bumped with the cache's atomic
+    ``incr``, so concurrent wrong guesses are all counted. The alias must point
+    to a cache shared by every worker (e.g. Redis) outside of local runs.
+    """
+
+    def __init__(self, alias=None, ttl=None):
+        self.alias = alias or settings.SMS_VERIFICATION_CACHE_ALIAS
+        self.ttl = ttl or settings.SMS_VERIFICATION_TTL
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _keys(user) -> tuple[str, str]:
+        return f'losb:otp:{user.pk}', f'losb:otp:{user.pk}:attempts'
+
+    @staticmethod
+    def _consumed_key(user, created_at: float) -> str:
+        return f'losb:otp:{user.pk}:{created_at}:consumed'
+
+    def get(self, user) -> OtpRecord | None:
+        record_key, attempts_key = self._keys(user)
+        values = self.cache.get_many([record_key, attempts_key])
+        if record_key not in values:
+            return None
+        otp, created_at, _ = values[record_key]
+        return OtpRecord(
+            otp=otp,
+            attempts=values.get(attempts_key, 0),
+            created_at=datetime.fromtimestamp(created_at, tz=dt_timezone.utc),
+        )
+
+    def create(self, user, otp: str, outbox: SmsOutbox) -> OtpRecord:
+        record_key, attempts_key = self._keys(user)
+        created_at = timezone.now()
+        self.cache.set_many({
+            record_key: (otp, created_at.timestamp(), outbox.pk),
+            attempts_key: 0,
+        }, timeout=self.ttl)
+        return OtpRecord(otp=otp, attempts=0, created_at=created_at)
+
+    def reserve_attempt(self, user, limit: int) -> bool:
+        try:
+            return self.cache.incr(self._keys(user)[1]) <= limit
+        except ValueError:  # expired or consumed in the meantime
+            return False
+
+    def consume(self, user, otp: str) -> bool:
+        record_key, _ = self._keys(user)
+        record = self.cache.get(record_key)
+        if record is None or record[0] != otp:
+            return False
+        # add() only succeeds for the first caller, it is the compare-and-delete of caches
+        if not self.cache.add(self._consumed_key(user, record[1]), True, timeout=self.ttl):
+            return False
+        self.delete(user)
+        return True
+
+    def delete(self, user):
+        self.cache.delete_many(self._keys(user))
+
+    def get_outbox(self, user) -> SmsOutbox | None:
+        record = self.cache.get(self._keys(user)[0])
+        if record is None:
+            return None
+        return SmsOutbox.objects.filter(pk=record[2]).first()
+
+
+class ModelOtpStore(OtpStore):
+    """
+    Codes kept as ``SMSVerification`` rows referenced by ``User.sms_verification``.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or settings.SMS_VERIFICATION_TTL
+
+    def get(self, user) -> OtpRecord | None:
+        # by id: a concurrent guess may have consumed the row behind the cached relation
+        verification = SMSVerification.objects.filter(pk=user.sms_verification_id).first()
+        if verification is None:
+            return None
+        return OtpRecord(otp=verification.otp, attempts=verification.attempts, created_at=verification.created_at)
+
+    def create(self, user, otp: str, outbox: SmsOutbox) -> OtpRecord:
+        verification = SMSVerification.objects.create(otp=otp)
+        outbox.verification = verification
+        outbox.save(update_fields=['verification'])
+        user.sms_verification = verification
+        user.save()
+        return OtpRecord(otp=otp, attempts=0, created_at=verification.created_at)
+
+    def reserve_attempt(self, user, limit: int) -> bool:
+        # one UPDATE ... SET attempts = attempts + 1 WHERE attempts < limit, the row count is the verdict
+        return SMSVerification.objects.filter(
+            pk=user.sms_verification_id,
+            attempts__lt=limit,
+            created_at__gte=timezone.now() - timedelta(seconds=self.ttl),
+        ).update(attempts=F('attempts') + 1) == 1
+
+    def consume(self, user, otp: str) -> bool:
+        _, deleted = SMSVerification.objects.filter(pk=user.sms_verification_id, otp=otp).delete()
+        if not deleted.get(SMSVerification._meta.label):
+            return False
+        user.sms_verification = None
+        return True
+
+    def delete(self, user):
+        SMSVerification.objects.filter(pk=user.sms_verification_id).delete()
+
+    def get_outbox(self, user) -> SmsOutbox | None:
+        return SmsOutbox.objects.filter(verification_id=user.sms_verification_id).order_by('-pk').first()
+
+
+otp_store = import_string(settings.SMS_VERIFICATION_STORE)()
@@ -0,0 +1,69 @@
+import re
+from typing import NamedTuple
+
+# calling code, national significant number pattern, trunk prefix dialled before it at home.
+# Covers the markets we serve, it is not a full numbering plan database.
+COUNTRY_RULES = (
+    ('7', r'[3489]\d{9}', '8'),                      # Russia, Kazakhstan
+    ('375', r'(?:1[5-7]|2[2-59]|33|44)\d{7}', '80'),  # Belarus
+    ('380', r'[3-9]\d{8}', '0'),                     # Ukraine
+    ('373', r'[2-8]\d{7}', '0'),                     # Moldova
+    ('374', r'[1-9]\d{7}', '0'),                     # Armenia
+    ('992', r'[3-9]\d{8}', ''),                      # Tajikistan
+    ('993', r'[1-6]\d{7}', '8'),                     # Turkmenistan
+    ('994', r'[1-9]\d{8}', '0'),                     # Azerbaijan
+    ('995', r'[3-7]\d{8}', '0'),                     # Georgia
+    ('996', r'[2-9]\d{8}', '0'),                     # Kyrgyzstan
+    ('998', r'[1-9]\d{8}', ''),                      # Uzbekistan
+    ('1', r'[2-9]\d{2}[2-9]\d{6}', '1'),             # NANP
+    ('44', r'[1-9]\d{9}', '0'),                      # United Kingdom
+    ('49', r'[1-9]\d{5,13}', '0'),                   # Germany
+    ('90', r'[2-5]\d{9}', '0'),                      # Turkey
+    ('972', r'[2-9]\d{7,8}', '0'),                   # Israel
+)
+
+# one compiled matcher per calling code, looked up with a single dict access
+RULES = {code: (re.compile(pattern).fullmatch, trunk) for code, pattern, trunk in COUNTRY_RULES}
+# formatting characters people type around numbers, dropped with one str.translate
+FORMATTING = str.maketrans('', '', ' -().+ ')
+
+
+class InvalidPhoneNumber(ValueError):
+    pass
+
+
+class PhoneNumber(NamedTuple):
+    code: str
+    number: str
+
+    @property
+    def e164(self) -> str:
+        return f'+{self.code}{self.number}'
+
+
+def _digits(value) -> str:
+    digits = str(value).translate(FORMATTING)
+    if not digits.isascii() or not digits.isdigit():
+        raise InvalidPhoneNumber(f'Not a phone number: {value!r}')
+    return digits
+
+
+def parse_phone(code, number) -> PhoneNumber:
+    """
+    Canonical calling code and national number from user input.
+
+    Accepts formatting characters, a national number typed with its trunk
+    prefix (8 999 ...) and a number typed together with its calling code.
+    """
+    code, number = _digits(code), _digits(number or '')
+    if code not in RULES:
+        raise InvalidPhoneNumber(f'Unsupported country code: +{code}')
+    matches, trunk = RULES[code]
+    if not matches(number):
+        if number.startswith(code) and matches(number[len(code):]):
+            number = number[len(code):]
+        elif trunk and number.startswith(trunk) and matches(number[len(trunk):]):
+            number = number[len(trunk):]
+        else:
+            raise InvalidPhoneNumber(f'Invalid phone number for +{code}: {number}')
+    return PhoneNumber(code, number)
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from losb.api.v1.services.counters import bump_counter, get_counters
+
+
+class ProfileCache:
+    """
+    Read-through user/profile cache shared by all workers via Django ``CACHES``.
+
+    Keys embed a per-user version counter and a global generation, so a write
+    only has to bump a counter: stale entries become unreachable and expire on
+    their own.
+    """
+    GENERATION_KEY = 'losb:profile:generation'
+
+    def __init__(self, alias: str, timeout: int):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _version_key(telegram_id) -> str:
+        return f'losb:profile:{telegram_id}:version'
+
+    def get_version(self, telegram_id) -> str:
+        """
+        Current cache namespace of the user, fetched in a single round-trip.
+        """
+        generation, version = get_counters(self.cache, self.GENERATION_KEY, self._version_key(telegram_id))
+        return f'{generation}.{version}'
+
+    def bump(self, telegram_id):
+        bump_counter(self.cache, self._version_key(telegram_id))
+
+    def bump_all(self):
+        bump_counter(self.cache, self.GENERATION_KEY)
+
+    def get_user(self, telegram_id, version: str, projection: str = 'full'):
+        return self.cache.get(self._key(telegram_id, version, f'user:{projection}'))
+
+    def set_user(self, telegram_id, version: str, user, projection: str = 'full'):
+        self.cache.set(self._key(telegram_id, version, f'user:{projection}'), user, self.timeout)
+
+    def get_profile(self, telegram_id, version: str):
+        return self.cache.get(self._key(telegram_id, version, 'profile'))
+
+    def set_profile(self, telegram_id, version: str, data):
+        self.cache.set(self._key(telegram_id, version, 'profile'), data, self.timeout)
+
+    def get_or_set_profile(self, telegram_id, serialize):
+        """
+        Cached serialized profile of the user, ``serialize()`` builds it on a miss.
+        """
+        version = self.get_version(telegram_id)
+        data = self.get_profile(telegram_id, version)
+        if data is None:
+            data = serialize()
+            self.set_profile(telegram_id, version, data)
+        return data
+
+    @staticmethod
+    def _key(telegram_id, version: str, kind: str) -> str:
+        return f'losb:profile:{telegram_id}:{version}:{kind}'
+
+
+profile_cache = ProfileCache(
+    alias=settings.PROFILE_CACHE_ALIAS,
+    timeout=settings.PROFILE_CACHE_TIMEOUT,
+)
@@ -0,0 +1,247 @@
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from losb.api.v1.services.phone_numbers import InvalidPhoneNumber, parse_phone
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE = re.compile(r'^(?P<algorithm>sliding|bucket):(?P<count>\d+)/(?P<period>\d*)(?P<unit>[smhd])$')
+
+
+class MemoryBackend:
+    """
+    Per-process counters, for single-process runs and as a fallback.
+
+    Bounded like UserCache: the least recently written key is dropped when
+    ``max_size`` is reached, so per-IP keys cannot grow without limit.
+    """
+
+    def __init__(self, max_size: int = 100_000):
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry[1]
+
+    def _set(self, key, value, ttl):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def incr(self, key: str, ttl: float) -> int:
+        with self._lock:
+            value = (self._get(key, time.monotonic()) or 0) + 1
+            self._set(key, value, ttl)
+            return value
+
+    def decr(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = (entry[0], entry[1] - 1)
+
+    def get_many(self, keys) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {key: value for key in keys if (value := self._get(key, now)) is not None}
+
+    def update(self, key: str, fn, ttl: float):
+        with self._lock:
+            value, result = fn(self._get(key, time.monotonic()))
+            self._set(key, value, ttl)
+            return result
+
+
+class CacheBackend:
+    """
+    Counters in ``CACHES`` shared by every worker.
+
+    ``incr`` is atomic on Redis and memcached. ``update`` is a compare-and-set:
+    the value carries a version, and a writer must first ``add`` the claim key
+    of the next version, which only one of concurrent writers manages. The
+    others read again and retry; after ``max_retries`` lost races the write
+    goes through unconditionally rather than failing the request.
+    """
+    CLAIM_TIMEOUT = 1
+
+    def __init__(self, alias: str, max_retries: int = 10):
+        self.alias = alias
+        self.max_retries = max_retries
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def incr(self, key: str, ttl: float) -> int:
+        self.cache.add(key, 0, timeout=math.ceil(ttl))
+        try:
+            return self.cache.incr(key)
+        except ValueError:  # expired between add and incr
+            self.cache.set(key, 1, timeout=math.ceil(ttl))
+            return 1
+
+    def decr(self, key: str):
+        try:
+            self.cache.decr(key)
+        except ValueError:  # expired meanwhile, nothing left to give back
+            pass
+
+    def get_many(self, keys) -> dict:
+        return self.cache.get_many(list(keys))
+
+    def update(self, key: str, fn, ttl: float):
+        # (version, value) pairs live under their own key, apart from plain values written by older releases
+        key = f'{key}:cas'
+        for _ in range(self.max_retries):
+            version, state = self.cache.get(key) or (0, None)
+            value, result = fn(state)
+            if self.cache.add(f'{key}:{version + 1}', 1, timeout=self.CLAIM_TIMEOUT):
+                break
+        self.cache.set(key, (version + 1, value), timeout=math.ceil(ttl))
+        return result
+
+
+class SlidingWindow:
+    """
+    Sliding window approximated from two fixed-window counters.
+
+    The previous window's count is weighted by how much of it still overlaps
+    the sliding window, which keeps each check at one increment and one read.
+    A rejected request gives its increment back, so retrying while limited
+    does not extend the lockout.
+    """
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+
+    def hit(self, backend, key: str, now: float) -> float | None:
+        window, elapsed = divmod(now, self.period)
+        current_key, previous_key = f'{key}:{int(window)}', f'{key}:{int(window) - 1}'
+        current = backend.incr(current_key, ttl=2 * self.period)
+        previous = backend.get_many([previous_key]).get(previous_key, 0)
+
+        overlap = 1 - elapsed / self.period
+        if previous * overlap + current <= self.limit:
+            return None
+        backend.decr(current_key)
+        return self._wait(previous, current, elapsed)
+
+    def _wait(self, previous: int, current: int, elapsed: float) -> float:
+        # seconds until previous * overlap + current + 1 fits into the limit again
+        room = self.limit - current - 1
+        if room >= 0 and previous:
+            return max(0.0, self.period * (1 - room / previous) - elapsed)
+        # not before the next window, where the current count becomes the previous one
+        return self.period - elapsed + max(0.0, self.period * (1 - (self.limit - 1) / current))
+
+
+class TokenBucket:
+    """
+    ``limit`` tokens refilled evenly over ``period``: allows bursts up to the
+    limit while holding the long-run rate.
+    """
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.rate = limit / period
+
+    def hit(self, backend, key: str, now: float) -> float | None:
+        def take(state):
+            tokens, updated = state or (self.limit, now)
+            tokens = min(self.limit, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                return (tokens - 1, now), None
+            return (tokens, now), (1 - tokens) / self.rate
+
+        return backend.update(key, take, ttl=self.limit / self.rate)
+
+
+ALGORITHMS = {'sliding': SlidingWindow, 'bucket': TokenBucket}
+
+
+def parse_rate(rate: str):
+    """
+    ``'sliding:5/h'`` or ``'bucket:20/10m'`` into an algorithm instance.
+    """
+    match = RATE.match(rate)
+    if match is None:
+        raise ValueError(f'Invalid rate limit {rate!r}, expected e.g. "sliding:5/h" or "bucket:20/10m"')
+    period = int(match['period'] or 1) * PERIODS[match['unit']]
+    return ALGORITHMS[match['algorithm']](int(match['count']), period)
+
+
+class RateLimiter:
+    """
+    Named rate limits from ``settings.RATE_LIMITS`` checked against one backend.
+    """
+
+    def __init__(self, backend, rates: dict[str, str]):
+        self.backend = backend
+        self.configure(rates)
+
+    def configure(self, rates: dict[str, str]):
+        self.limits = {scope: parse_rate(rate) for scope, rate in rates.items()}
+
+    def hit(self, scope: str, ident: str) -> float | None:
+        """
+        Count a request of ``ident`` against ``scope``; seconds to wait if it is over the limit.
+        """
+        return self.limits[scope].hit(self.backend, f'losb:rl:{scope}:{ident}', time.time())
+
+
+class RateLimitThrottle(BaseThrottle):
+    """
+    Applies the limits a view declares per method in ``rate_limits``, e.g.
+    ``{'POST': (('otp-request-phone', 'phone'),)}``, where the second item picks
+    the key: the authenticated user, the client IP or the phone in the body.
+
+    The client IP trusts only the ``NUM_PROXIES`` last X-Forwarded-For hops,
+    see the setting.
+    """
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        for scope, key in getattr(view, 'rate_limits', {}).get(request.method, ()):
+            ident = self.get_key(request, key)
+            if ident is None:
+                continue
+            self.retry_after = rate_limiter.hit(scope, ident)
+            if self.retry_after is not None:
+                return False
+        return True
+
+    def get_key(self, request, key: str):
+        if key == 'user':
+            return request.user.pk if request.user.is_authenticated else None
+        if key == 'ip':
+            return self.get_ident(request)
+        if key == 'phone':
+            phone = request.data.get('phone', request.data) if hasattr(request.data, 'get') else None
+            if not hasattr(phone, 'get'):
+                return None
+            try:
+                return parse_phone(phone.get('code', ''), phone.get('number')).e164
+            except InvalidPhoneNumber:
+                return None
+        raise ValueError(f'Unknown rate limit key {key!r}')
+
+    def wait(self):
+        return math.ceil(self.retry_after) if self.retry_after is not None else None
+
+
+rate_limiter = RateLimiter(
+    backend=MemoryBackend() if settings.RATE_LIMIT_BACKEND == 'memory' else CacheBackend(settings.RATE_LIMIT_CACHE_ALIAS),
+    rates=settings.RATE_LIMITS,
+)
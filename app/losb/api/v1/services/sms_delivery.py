@@ -0,0 +1,52 @@
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils import timezone
+
+from losb.models import SmsDeliveryReport
+
+MESSAGE_ID = re.compile(r'^[\w-]{1,64}$')
+
+
+def parse_callback(entries, max_entries: int) -> tuple[dict[str, tuple[int, datetime]], int]:
+    """
+    Status reports from the ``data[]`` entries of a sms.ru callback.
+
+    Each entry is ``"sms_status\\n<sms id>\\n<status code>\\n<unix time>"``;
+    other callback types and malformed entries are counted as skipped. When a
+    message is reported more than once the latest report wins.
+    """
+    reports, skipped = {}, 0
+    for entry in entries[:max_entries]:
+        lines = entry.split('\n')
+        if len(lines) < 3 or lines[0].strip() != 'sms_status':
+            skipped += 1
+            continue
+        message_id, code = lines[1].strip(), lines[2].strip()
+        timestamp = lines[3].strip() if len(lines) > 3 else ''
+        if not MESSAGE_ID.match(message_id) or not code.isdigit() or (timestamp and not timestamp.isdigit()):
+            skipped += 1
+            continue
+        reported_at = datetime.fromtimestamp(int(timestamp), tz=dt_timezone.utc) if timestamp else timezone.now()
+        if message_id not in reports or reports[message_id][1] <= reported_at:
+            reports[message_id] = (int(code), reported_at)
+    return reports, skipped + max(0, len(entries) - max_entries)
+
+
+def record_reports(reports: dict[str, tuple[int, datetime]]) -> int:
+    """
+    Upsert the reports with a single INSERT ... ON CONFLICT (provider_message_id) DO UPDATE.
+    """
+    if not reports:
+        return 0
+    now = timezone.now()
+    SmsDeliveryReport.objects.bulk_create(
+        [
+            SmsDeliveryReport(provider_message_id=message_id, status_code=code, reported_at=reported_at, updated_at=now)
+            for message_id, (code, reported_at) in reports.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['provider_message_id'],
+        update_fields=['status_code', 'reported_at', 'updated_at'],
+    )
+    return len(reports)
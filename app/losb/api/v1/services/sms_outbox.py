@@ -0,0 +1,102 @@
+import math
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from losb.models import SmsOutbox
+
+
+class SmsOutboxService:
+    """
+    Enqueue, claim and settle outgoing SMS stored in ``SmsOutbox``.
+
+    Claimed rows move to ``sending`` with ``next_attempt_at`` pushed by the
+    lease, so rows of a crashed worker become claimable again once it expires.
+    The lease covers the worst case of the whole batch: ``send_timeout``, the
+    longest a single send may take, for every round of ``concurrency`` sends.
+
+    Every claim stamps its rows with a new ``claim_token``. A worker that
+    outlived its lease can't settle rows another worker has claimed since:
+    ``mark_sent`` and ``mark_failed`` then return False and change nothing.
+    """
+
+    def __init__(self, max_attempts: int, backoff: float, send_timeout: float):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.send_timeout = send_timeout
+
+    @staticmethod
+    def enqueue(phone: str, message: str, verification=None, expires_at=None) -> SmsOutbox:
+        return SmsOutbox.objects.create(phone=phone, message=message, verification=verification, expires_at=expires_at)
+
+    def lease(self, batch_size: int, concurrency: int) -> float:
+        return self.send_timeout * math.ceil(batch_size / concurrency)
+
+    def claim(self, batch_size: int, concurrency: int = 1) -> list[SmsOutbox]:
+        now = timezone.now()
+        token = uuid.uuid4()
+        due = Q(status=SmsOutbox.Status.PENDING) | Q(status=SmsOutbox.Status.SENDING, next_attempt_at__lte=now)
+        with transaction.atomic():
+            # nobody can use the code in these any more, sending them would only cost money
+            SmsOutbox.objects.filter(due, expires_at__lte=now).update(
+                status=SmsOutbox.Status.DEAD,
+                claim_token=None,
+                last_error='expired before it was sent',
+                updated_at=now,
+            )
+            rows = list(
+                SmsOutbox.objects
+                .select_for_update(skip_locked=True)
+                .filter(due, next_attempt_at__lte=now)
+                .order_by('next_attempt_at')[:batch_size]
+            )
+            SmsOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+                status=SmsOutbox.Status.SENDING,
+                next_attempt_at=now + timedelta(seconds=self.lease(batch_size, concurrency)),
+                claim_token=token,
+                updated_at=now,
+            )
+        for row in rows:
+            row.status = SmsOutbox.Status.SENDING
+            row.claim_token = token
+        return rows
+
+    @staticmethod
+    def _settle(row: SmsOutbox, **fields) -> bool:
+        return bool(
+            SmsOutbox.objects
+            .filter(pk=row.pk, status=SmsOutbox.Status.SENDING, claim_token=row.claim_token)
+            .update(claim_token=None, updated_at=timezone.now(), **fields)
+        )
+
+    def mark_sent(self, row: SmsOutbox, provider_message_id) -> bool:
+        return self._settle(
+            row,
+            status=SmsOutbox.Status.SENT,
+            attempts=row.attempts + 1,
+            provider_message_id=provider_message_id,
+            last_error='',
+        )
+
+    def mark_failed(self, row: SmsOutbox, error: str) -> bool:
+        attempts = row.attempts + 1
+        if attempts >= self.max_attempts:
+            return self._settle(row, status=SmsOutbox.Status.DEAD, attempts=attempts, last_error=error)
+        return self._settle(
+            row,
+            status=SmsOutbox.Status.PENDING,
+            attempts=attempts,
+            last_error=error,
+            next_attempt_at=timezone.now() + timedelta(seconds=self.backoff * 2 ** (attempts - 1)),
+        )
+
+
+sms_outbox = SmsOutboxService(
+    max_attempts=settings.SMS_OUTBOX_MAX_ATTEMPTS,
+    backoff=settings.SMS_OUTBOX_RETRY_BACKOFF,
+    send_timeout=settings.SMS_OUTBOX_SEND_TIMEOUT,
+)
@@ -0,0 +1,205 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from losb.api.v1 import exceptions
+
+
+class ProviderHealth:
+    """
+    Rolling success rate and latency of one provider plus its circuit breaker.
+
+    The breaker opens when, over the last ``window`` seconds, at least
+    ``min_calls`` calls were made and the failure rate reached
+    ``failure_rate``. After ``cooldown`` seconds it lets a single probe call
+    through (half-open): success closes it, failure opens it again. A probe
+    that reports nothing within ``probe_timeout`` seconds (defaults to
+    ``cooldown``) is given up and the next caller may probe instead.
+
+    ``is_available`` only reads the state and is what ranking uses; ``acquire``
+    takes the probe slot and is called right before the provider is.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, window: float, min_calls: int, failure_rate: float, cooldown: float,
+                 probe_timeout: float = None):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.probe_timeout = cooldown if probe_timeout is None else probe_timeout
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        self._calls = deque()  # (finished at, ok, latency)
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _can_probe(self, now: float) -> bool:
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.cooldown
+        return self.state == self.HALF_OPEN and now - self.probe_started_at >= self.probe_timeout
+
+    def is_available(self) -> bool:
+        with self._lock:
+            return self.state == self.CLOSED or self._can_probe(time.monotonic())
+
+    def acquire(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if not self._can_probe(now):
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_started_at = now
+            return True
+
+    def release(self):
+        """
+        Give back a probe slot taken by ``acquire`` whose call never reported.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record(self, ok: bool, latency: float):
+        now = time.monotonic()
+        with self._lock:
+            self._calls.append((now, ok, latency))
+            self._trim(now)
+            previous = self.state
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED if ok else self.OPEN
+            elif self.state == self.CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(not call_ok for _, call_ok, _ in self._calls)
+                if failures / len(self._calls) >= self.failure_rate:
+                    self.state = self.OPEN
+            # late results of calls started before the breaker opened must not push the cooldown back
+            if self.state == self.OPEN and previous != self.OPEN:
+                self.opened_at = now
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._calls)
+            latencies = sorted(latency for _, _, latency in self._calls)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'success_rate': sum(ok for _, ok, _ in self._calls) / calls if calls else 1.0,
+                'p50_ms': latencies[calls // 2] * 1000 if calls else 0.0,
+            }
+
+
+class SmsRouter:
+    """
+    Sends through the healthiest available provider and fails over to the next.
+
+    Providers with an open breaker are skipped; the rest are ordered by rolling
+    success rate, then median latency. With ``hedge_after`` set, a second
+    provider is started when the first hasn't answered in that many seconds
+    and the first success wins (the user may then receive the code twice).
+    """
+
+    def __init__(self, providers, hedge_after: float = 0, window: float = 60, min_calls: int = 5,
+                 failure_rate: float = 0.5, cooldown: float = 30):
+        self.providers = list(providers)
+        self.hedge_after = hedge_after
+        self.health = {
+            provider.name: ProviderHealth(window, min_calls, failure_rate, cooldown)
+            for provider in self.providers
+        }
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(self.providers), thread_name_prefix='sms-router')
+
+    def ranked(self) -> list:
+        available = [provider for provider in self.providers if self.health[provider.name].is_available()]
+        stats = {provider.name: self.health[provider.name].stats() for provider in available}
+        return sorted(available, key=lambda p: (-stats[p.name]['success_rate'], stats[p.name]['p50_ms']))
+
+    def send_sms(self, phone: str, message: str) -> dict:
+        candidates = self.ranked()
+        if not candidates:
+            raise exceptions.SmsDeliveryError('Failed to send SMS: every provider circuit is open')
+
+        errors = []
+        if self.hedge_after and len(candidates) > 1:
+            primary, secondary, *candidates = candidates
+            result = self._send_hedged(primary, secondary, phone, message, errors)
+            if result is not None:
+                return result
+
+        for provider in candidates:
+            try:
+                return self._send(provider, phone, message)
+            except exceptions.SmsDeliveryError as e:
+                errors.append(f'{provider.name}: {e.detail}')
+
+        raise exceptions.SmsDeliveryError(f"Failed to send SMS: {'; '.join(errors)}")
+
+    def _send(self, provider, phone: str, message: str) -> dict:
+        health = self.health[provider.name]
+        if not health.acquire():
+            # another request took the half-open probe since ranking
+            raise exceptions.SmsDeliveryError('circuit is open')
+        started = time.perf_counter()
+        try:
+            result = provider.send_sms(phone, message)
+        except Exception:
+            health.record(False, time.perf_counter() - started)
+            raise
+        except BaseException:
+            health.release()
+            raise
+        health.record(True, time.perf_counter() - started)
+        return {**result, 'provider': provider.name}
+
+    def _send_hedged(self, primary, secondary, phone: str, message: str, errors: list):
+        futures = {self._executor.submit(self._send, primary, phone, message): primary}
+        hedged = False
+        while futures:
+            done, _ = wait(futures, timeout=None if hedged else self.hedge_after, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = futures.pop(future)
+                try:
+                    return future.result()
+                except exceptions.SmsDeliveryError as e:
+                    errors.append(f'{provider.name}: {e.detail}')
+            if not hedged:
+                # the primary is slow or has already failed
+                futures[self._executor.submit(self._send, secondary, phone, message)] = secondary
+                hedged = True
+        return None
+
+    def stats(self) -> dict:
+        return {name: health.stats() for name, health in self.health.items()}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_sms_sender() -> SmsRouter:
+    """
+    Process-wide router over ``SMS_PROVIDERS``, so provider health survives between sends.
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = SmsRouter(
+                    [import_string(path)() for path in settings.SMS_PROVIDERS],
+                    hedge_after=settings.SMS_HEDGE_AFTER,
+                    window=settings.SMS_HEALTH_WINDOW,
+                    min_calls=settings.SMS_BREAKER_MIN_CALLS,
+                    failure_rate=settings.SMS_BREAKER_FAILURE_RATE,
+                    cooldown=settings.SMS_BREAKER_COOLDOWN,
+                )
+    return _router
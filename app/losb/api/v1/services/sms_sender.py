@@ -1,15 +1,45 @@
+import random
+from abc import ABC, abstractmethod
+import time
 from urllib.parse import quote
+from uuid import uuid4
 
 import requests
 from django.conf import settings
 
 from losb.api.v1 import exceptions
+from losb.api.v1.services.http import PooledHttpClient
 
+# shared by every SmsRuService so OTPs reuse warm keep-alive connections to sms.ru
+sms_ru_client = PooledHttpClient(
+    pool_size=settings.SMS_RU_POOL_SIZE,
+    connect_timeout=settings.SMS_RU_CONNECT_TIMEOUT,
+    read_timeout=settings.SMS_RU_READ_TIMEOUT,
+    max_retries=settings.SMS_RU_MAX_RETRIES,
+    backoff=settings.SMS_RU_RETRY_BACKOFF,
+)
 
-class SmsRuService:
-    BASE_URL = "https://sms.ru/sms/send"
+
+class SmsProvider(ABC):
+    """
+    Interface of an SMS provider usable by SmsRouter.
+
+    ``send_sms`` returns a sms.ru style result and raises SmsDeliveryError
+    when the message could not be handed over.
+    """
+    name = None
+
+    @abstractmethod
+    def send_sms(self, phone: str, message: str) -> dict:
+        ...
+
+
+class SmsRuService(SmsProvider):
+    BASE_URL = settings.SMS_RU_BASE_URL
+    name = 'sms.ru'
 
     def __init__(self):
+        self.client = sms_ru_client
         self.api_key = settings.SMS_RU_API_KEY
         self.default_params = {
             'api_id': self.api_key,
@@ -21,7 +51,7 @@ class SmsRuService:
         Send SMS using sms.ru API
 
         Args:
-            phone: Phone number (ex. 74993221627)
+            phone: Phone number (ex. +74993221627)
             message: Text message to send
 
         Returns:
@@ -35,11 +65,11 @@ class SmsRuService:
 
             params = {
                 **self.default_params,
-                'to': phone,
+                'to': phone.lstrip('+'),
                 'msg': encoded_message
             }
 
-            response = requests.get(self.BASE_URL, params=params)
+            response = self.client.get(self.BASE_URL, params=params)
             response.raise_for_status()
 
             result = response.json()
@@ -57,3 +87,37 @@ class SmsRuService:
 
         except Exception as e:
             raise exceptions.SmsDeliveryError(f"Failed to send SMS: {str(e)}")
+
+
+class FakeSmsService(SmsProvider):
+    """
+    Local stand-in for SmsRuService that answers like sms.ru without sending anything.
+
+    ``latency`` (seconds) and ``error_rate`` (0..1) let tests and local runs
+    simulate a slow or flaky provider.
+    """
+
+    def __init__(self, name='fake', latency=None, error_rate=None):
+        self.name = name
+        self.latency = settings.SMS_FAKE_LATENCY if latency is None else latency
+        self.error_rate = settings.SMS_FAKE_ERROR_RATE if error_rate is None else error_rate
+
+    def send_sms(self, phone: str, message: str) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise exceptions.SmsDeliveryError(f'Failed to send SMS: {self.name} injected failure')
+        return {
+            'status': 'OK',
+            'sms': {phone: {'status': 'OK', 'status_code': 100, 'sms_id': f'fake-{uuid4().hex}'}},
+        }
+
+
+def get_provider_message_id(result: dict):
+    """
+    Message id from a sms.ru style ``send_sms`` result, if one was returned.
+    """
+    for sms in (result.get('sms') or {}).values():
+        if sms.get('sms_id'):
+            return sms['sms_id']
+    return None
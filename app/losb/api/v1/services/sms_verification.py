@@ -1,98 +1,111 @@
+import math
+from datetime import timedelta
 from random import SystemRandom
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 
 from app import settings
 from losb.api.v1 import exceptions
-from losb.api.v1.serializers import PhoneSerializer, SMSVerificationSerializer
-from losb.api.v1.services.sms_sender import SmsRuService
+from losb.api.v1.serializers import PhoneSerializer
+from losb.api.v1.services.otp_store import otp_store
+from losb.api.v1.services.phone_numbers import parse_phone
+from losb.api.v1.services.sms_outbox import sms_outbox
+from losb.models import Phone, User
 
 
 class SmsVerificationService:
-    def __init__(self, user):
+    def __init__(self, user, store=otp_store):
         self.user = user
-        self.sms_service = SmsRuService()
+        self.store = store
 
     @staticmethod
     def generate_otp():
         return "".join(SystemRandom().choice('123456789') for _ in range(settings.SMS_VERIFICATOIN_CODE_DIGITS))
 
     def request_verification(self, code, number):
+        phone = parse_phone(code, number)
+
         # Check if phone is already verified
-        if self.user.phone.code == code and self.user.phone.number == number:
+        if self.user.phone_e164 == phone.e164:
             raise exceptions.PhoneAlreadyVerified()
+        if User.objects.filter(phone_e164=phone.e164).exists():
+            raise exceptions.PhoneAlreadyInUse()
 
         # Check cooldown period
         self._check_cooldown()
         #
-        # Generate and save OTP
+        # Generate and save OTP, sms-outbox-worker delivers it
         otp = self.generate_otp()
 
-        try:
-            message = self._get_verification_message(otp)
-            phone = code+number
-            self.sms_service.send_sms(phone, message)
-        except exceptions.SmsDeliveryError as e:
-            # You might want to delete the verification code if SMS fails
-            self.user.sms_verification.delete()
-            raise
-
-        self._save_verification(otp)
+        with transaction.atomic():
+            outbox = sms_outbox.enqueue(
+                phone=phone.e164,
+                message=self._get_verification_message(otp),
+                expires_at=timezone.now() + timedelta(seconds=settings.SMS_VERIFICATION_TTL),
+            )
+            self.store.create(self.user, otp, outbox)
 
         return otp
 
-    def verify_code(self, otp, code, number):
-        if not self.user.sms_verification:
+    def get_delivery_status(self):
+        outbox = self.store.get_outbox(self.user)
+        if outbox is None:
             raise exceptions.SmsVerificationNotSend()
+        return outbox
 
-        self._check_verification_expiry()
-        self._check_verification_attempts()
+    def verify_code(self, otp, code, number):
+        serializer = PhoneSerializer(self.user, data={"code": code, "number": number})
+        serializer.is_valid(raise_exception=True)
+
+        if not self.store.reserve_attempt(self.user, settings.SMS_VERIFICATION_ATTEMPTS):
+            self._reject_attempt()
 
-        if self.user.sms_verification.otp != otp:
-            self._increment_attempts()
-            raise exceptions.SmsVerificationFailed()
+        # only the guess that consumes the code updates the phone, in the same transaction
+        try:
+            with transaction.atomic():
+                if not self.store.consume(self.user, otp):
+                    raise exceptions.SmsVerificationFailed()
+                self._update_phone(serializer)
+        except IntegrityError:
+            # another account verified the same number in the meantime
+            raise exceptions.PhoneAlreadyInUse()
 
-        return self._update_phone({"code": code, "number": number})
+        return serializer.data
 
     def _check_cooldown(self):
-        if self.user.sms_verification:
-            td = timezone.now() - self.user.sms_verification.created_at
-            if td.seconds < settings.SMS_VERIFICATION_RESEND_COOLDOWN:
+        verification = self.store.get(self.user)
+        if verification:
+            # total_seconds: timedelta.seconds wraps around every day
+            wait = math.ceil(settings.SMS_VERIFICATION_RESEND_COOLDOWN - verification.age.total_seconds())
+            if wait > 0:
                 raise exceptions.SmsVerificationResendCooldown(
-                    detail=f'You must wait for {settings.SMS_VERIFICATION_RESEND_COOLDOWN - td.seconds} seconds'
+                    detail=f'You must wait for {wait} seconds'
                            f' before requesting a new SMS verification code.'
                 )
 
-    def _save_verification(self, otp):
-        serializer = SMSVerificationSerializer(data={'otp': otp})
-        serializer.is_valid(raise_exception=True)
-        self.user.sms_verification = serializer.save()
-        self.user.save()
-
-    def _check_verification_expiry(self):
-        td = timezone.now() - self.user.sms_verification.created_at
-        if td.seconds > settings.SMS_VERIFICATION_RESEND_COOLDOWN:
-            self.user.sms_verification.delete()
+    def _check_verification_expiry(self, verification):
+        if verification.age.total_seconds() > self.store.ttl:
+            self.store.delete(self.user)
             raise exceptions.SmsVerificationExpired()
 
-    def _check_verification_attempts(self):
-        if self.user.sms_verification.attempts > settings.SMS_VERIFICATION_ATTEMPTS:
-            self.user.sms_verification.delete()
-            raise exceptions.SmsVerificationAttemptsExceeded()
-
-    def _increment_attempts(self):
-        self.user.sms_verification.attempts += 1
-        self.user.sms_verification.save()
-
-    def _update_phone(self, phone):
-        serializer = PhoneSerializer(data=phone)
-        serializer.is_valid(raise_exception=True)
-
-        # TODO: Implement transaction handling here
-        self.user.number = serializer.save()
-        self.user.save()
-        self.user.sms_verification.delete()
+    def _reject_attempt(self):
+        # the store refused the attempt, read the code once to tell the user why
+        verification = self.store.get(self.user)
+        if verification is None:
+            raise exceptions.SmsVerificationNotSend()
+        self._check_verification_expiry(verification)
+        # not deleted: guesses that reserved an attempt earlier may still be checking it
+        raise exceptions.SmsVerificationAttemptsExceeded()
 
-        return serializer.data
+    @staticmethod
+    def _update_phone(serializer):
+        # the unique phone_e164 column rejects a number another user verified meanwhile
+        user = serializer.save()
+        # written to the deprecated Phone row too while the previous release may still read it
+        phone = {'code': user.phone_code, 'number': user.phone_number, 'e164': user.phone_e164}
+        if not Phone.objects.filter(pk=user.phone_id).update(**phone):
+            user.phone = Phone.objects.create(**phone)
+            user.save(update_fields=['phone'])
 
     @staticmethod
     def _get_verification_message(code: str) -> str:
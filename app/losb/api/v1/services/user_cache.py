@@ -0,0 +1,119 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class UserCache:
+    """
+    Bounded in-process cache of authenticated users keyed by telegram_id.
+
+    Entries expire after ``ttl`` seconds and the least recently used entry is
+    evicted once ``max_size`` is reached. Callers always receive a copy of the
+    cached user, so a request mutating ``request.user`` never leaks into others.
+    An entry stored with a shared profile version is only served while the
+    caller asks for that same version, which keeps workers consistent. Each
+    entry holds one instance per query projection the user was loaded with.
+    """
+
+    def __init__(self, ttl: int, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    @property
+    def generation(self) -> int:
+        """
+        Invalidation counter, taken before a DB load and passed back to set()
+        so a row loaded before a concurrent write is never cached.
+        """
+        return self._generation
+
+    def get(self, telegram_id, version=None, projection='full'):
+        if not self.enabled:
+            return None
+
+        key = str(telegram_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != version:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            user = entry[2].get(projection)
+            if user is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return copy.deepcopy(user)
+
+    def set(self, telegram_id, user, generation: int, version=None, projection='full'):
+        if not self.enabled:
+            return
+
+        key = str(telegram_id)
+        user = copy.deepcopy(user)
+        with self._lock:
+            if generation != self._generation:
+                return
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != version:
+                entry = (time.monotonic() + self.ttl, version, {})
+                self._entries[key] = entry
+            entry[2][projection] = user
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, telegram_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(str(telegram_id), None)
+
+    def invalidate_related(self, field: str, pk):
+        """
+        Drop every cached user whose ``field`` (e.g. ``location_id``) equals ``pk``,
+        or whose projection did not load ``field`` at all.
+        """
+        with self._lock:
+            self._generation += 1
+            stale = [
+                key for key, (_, _, users) in self._entries.items()
+                if any(user.__dict__.get(field, pk) == pk for user in users.values())
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+            }
+
+
+user_cache = UserCache(
+    ttl=settings.AUTH_USER_CACHE_TTL,
+    max_size=settings.AUTH_USER_CACHE_MAX_SIZE,
+)
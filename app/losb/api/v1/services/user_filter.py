@@ -0,0 +1,183 @@
+import hashlib
+import math
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from losb.api.v1.services.counters import bump_counter, get_counters
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    Sized for ``capacity`` items at the given false-positive rate; the k bit
+    positions are derived from one blake2b digest by double hashing.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class KnownUsersFilter:
+    """
+    Per-process Bloom filter of existing telegram_ids in front of the
+    authentication lookup: tokens of unknown users are rejected without
+    touching the database.
+
+    The filter is built outside of requests: workers load the copy published
+    in ``CACHES`` at startup (``warm_up``) and scan the users themselves only
+    when there is none yet. Until a worker has a filter every token goes on to
+    the regular lookup.
+
+    Users created afterwards are added to the local filter as they are saved
+    and announced through a shared counter: when a lookup misses and the
+    counter moved, the most recent users (by pk, with some slack for
+    transactions committing out of order) are pulled in before answering.
+    Once built, a miss is final. ``rebuild-user-filter`` publishes a fresh
+    filter and bumps the shared epoch so every worker loads it, which is also
+    how an overfull filter gets resized.
+    """
+    CREATED_KEY = 'losb:known-users:created'
+    EPOCH_KEY = 'losb:known-users:epoch'
+    SNAPSHOT_KEY = 'losb:known-users:snapshot'
+    PK_SLACK = 1000
+
+    def __init__(self, alias: str, false_positive_rate: float, enabled: bool = True):
+        self.alias = alias
+        self.false_positive_rate = false_positive_rate
+        self.enabled = enabled
+        self._filter = None
+        self._max_pk = 0
+        self._created = None
+        self._epoch = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def might_exist(self, telegram_id) -> bool:
+        if not self.enabled:
+            return True
+
+        key = str(telegram_id)
+        if self._filter is not None and key in self._filter:
+            return True
+
+        with self._lock:
+            created, epoch = get_counters(self.cache, self.CREATED_KEY, self.EPOCH_KEY)
+            if self._filter is None or epoch != self._epoch:
+                self._load(epoch)
+            if self._filter is None:
+                return True
+            if created != self._created:
+                self._refresh(created)
+            return key in self._filter
+
+    def add(self, telegram_id):
+        with self._lock:
+            if self._filter is not None and str(telegram_id) not in self._filter:
+                self._filter.add(str(telegram_id))
+
+    def announce_created(self):
+        bump_counter(self.cache, self.CREATED_KEY)
+
+    def reset(self):
+        bump_counter(self.cache, self.EPOCH_KEY)
+
+    def rebuild(self):
+        """
+        Build the filter from the users table and make every worker load it.
+        """
+        with self._lock:
+            self._build(*get_counters(self.cache, self.CREATED_KEY, self.EPOCH_KEY))
+            self.cache.set(self.SNAPSHOT_KEY, self._snapshot(), timeout=None)
+        self.reset()
+
+    def warm_up(self):
+        """
+        Load the published filter at startup, or build one if nothing is published yet.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            created, epoch = get_counters(self.cache, self.CREATED_KEY, self.EPOCH_KEY)
+            self._load(epoch)
+            if self._filter is None:
+                self._build(created, epoch)
+                # the first worker to start publishes it for the others
+                self.cache.add(self.SNAPSHOT_KEY, self._snapshot(), timeout=None)
+
+    def stats(self) -> dict:
+        bloom = self._filter
+        return {
+            'built': bloom is not None,
+            'count': bloom.count if bloom else 0,
+            'capacity': bloom.capacity if bloom else 0,
+            'bits': bloom.size if bloom else 0,
+            'hash_count': bloom.hash_count if bloom else 0,
+            'false_positive_rate': self.false_positive_rate,
+        }
+
+    def _load(self, epoch):
+        snapshot = self.cache.get(self.SNAPSHOT_KEY)
+        if snapshot is not None:
+            # users created since the snapshot was taken come in by pk on the next miss
+            self._created, self._max_pk, self._filter = snapshot
+        self._epoch = epoch
+
+    def _snapshot(self):
+        return self._created, self._max_pk, self._filter
+
+    def _build(self, created, epoch):
+        User = get_user_model()
+        # leave headroom for users created before the next rebuild
+        capacity = 2 * User.objects.count() + 1000
+        bloom = BloomFilter(capacity=capacity, false_positive_rate=self.false_positive_rate)
+        max_pk = 0
+        for pk, telegram_id in User.objects.values_list('pk', 'telegram_id').iterator(chunk_size=10000):
+            bloom.add(telegram_id)
+            max_pk = max(max_pk, pk)
+        self._filter = bloom
+        self._max_pk = max_pk
+        self._created = created
+        self._epoch = epoch
+
+    def _refresh(self, created):
+        User = get_user_model()
+        rows = User.objects.filter(pk__gt=self._max_pk - self.PK_SLACK).values_list('pk', 'telegram_id')
+        for pk, telegram_id in rows:
+            if telegram_id not in self._filter:
+                self._filter.add(telegram_id)
+            self._max_pk = max(self._max_pk, pk)
+        self._created = created
+
+
+known_users = KnownUsersFilter(
+    alias=settings.AUTH_USER_FILTER_CACHE_ALIAS,
+    false_positive_rate=settings.AUTH_USER_FILTER_FALSE_POSITIVE_RATE,
+    enabled=settings.AUTH_USER_FILTER_ENABLED,
+)
@@ -0,0 +1,17 @@
+from typing import Iterator
+
+from losb.models import User
+
+
+def iter_profiles(telegram_ids, chunk_size: int) -> Iterator[list[User]]:
+    """
+    Users with the given telegram_ids, chunk by chunk in the requested order.
+
+    Each chunk is one ``IN`` query with the ``profile`` projection, so a
+    user costs no extra query; unknown telegram_ids are skipped.
+    """
+    telegram_ids = list(dict.fromkeys(str(telegram_id) for telegram_id in telegram_ids))
+    for start in range(0, len(telegram_ids), chunk_size):
+        chunk = telegram_ids[start:start + chunk_size]
+        users = {user.telegram_id: user for user in User.objects.projected('profile').filter(telegram_id__in=chunk)}
+        yield [users[telegram_id] for telegram_id in chunk if telegram_id in users]
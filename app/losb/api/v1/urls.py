@@ -8,7 +8,8 @@ from losb.api.v1.views import (
     UserCityUpdateView,
     UserBirthdayAPIView,
     UserPhoneUpdateView,
-    CityListView, TechSupportAPIView,
+    CityListView, CitySearchView, CityNearestView, TechSupportAPIView,
+    BootstrapAPIView, SmsDeliveryCallbackView, UserProvisionView, UserLookupView,
 )
 
 app_name = 'losb'
@@ -17,10 +18,16 @@ app_name = 'losb'
 urlpatterns = [
     # path('', include(router.urls)),
     path('cities/', CityListView.as_view(), name='cities'),
+    path('cities/search', CitySearchView.as_view(), name='cities-search'),
+    path('cities/nearest', CityNearestView.as_view(), name='cities-nearest'),
     path('tech-support', TechSupportAPIView.as_view(), name='tech-support'),
+    path('bootstrap', BootstrapAPIView.as_view(), name='bootstrap'),
     path('user', UserRetrieveView.as_view(), name='user-detail'),
     path('user/name', UserNameUpdateView.as_view(), name='user-name'),
     path('user/city', UserCityUpdateView.as_view(), name='user-city'),
     path('user/birthday', UserBirthdayAPIView.as_view(), name='user-birthday'),
     path('user/phone', UserPhoneUpdateView.as_view(), name='user-phone'),
+    path('sms/callback', SmsDeliveryCallbackView.as_view(), name='sms-callback'),
+    path('internal/users/provision', UserProvisionView.as_view(), name='internal-user-provision'),
+    path('internal/users/profiles', UserLookupView.as_view(), name='internal-user-profiles'),
 ]
@@ -1,15 +1,21 @@
 from __future__ import annotations
 
+import hmac
 from random import SystemRandom
 
-from drf_spectacular.utils import extend_schema_view, extend_schema
+from django.http import HttpResponse, StreamingHttpResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter
 from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 from app import settings
 from losb.api.v1 import exceptions
+from losb.api.v1.renderers import JSONLinesRenderer
 from losb.api.v1.serializers import (
     UserSerializer,
     UserNameSerializer,
@@ -17,31 +23,119 @@ from losb.api.v1.serializers import (
     UserBirthdaySerializer,
     UserPhoneSerializer,
     CitySerializer,
+    CitySearchQuerySerializer,
+    CityDeltaQuerySerializer,
+    CityNearestQuerySerializer,
+    CityDistanceSerializer,
     UserPhoneVerificationSerializer,
     PhoneSerializer,
+    SmsDeliveryStatusSerializer,
     BotUrlSerializer,
+    BootstrapQuerySerializer,
+    BootstrapSerializer,
+    UserProvisionSerializer,
+    UserProvisionResultSerializer,
+    UserLookupSerializer,
 
 )
+from losb.api.v1.services.auth import IsInternalService
+from losb.api.v1.services.city_catalogue import city_catalogue
+from losb.api.v1.services.city_nearest import city_nearest
+from losb.api.v1.services.city_search import city_search
+from losb.api.v1.services.idempotency import idempotent_requests
+from losb.api.v1.services.profile_cache import profile_cache
+from losb.api.v1.services.sms_delivery import parse_callback, record_reports
 from losb.api.v1.services.sms_verification import SmsVerificationService
-from losb.models import City
+from losb.api.v1.services.user_lookup import iter_profiles
+from losb.models import City, User
 from losb.schema import TelegramIdJWTSchema  # do not remove, needed for swagger
 
 
+def get_cached_profile(request):
+    """
+    Serialized profile of the request user through ``profile_cache``.
+
+    Every endpoint returning the profile goes through here, so the cached
+    payload is the same whichever of them filled it, absolute avatar URL included.
+    """
+    return profile_cache.get_or_set_profile(
+        request.user.telegram_id,
+        lambda: UserSerializer(request.user, context={'request': request}).data,
+    )
+
+
 @extend_schema_view(
     get=extend_schema(
+        parameters=[CityDeltaQuerySerializer],
         responses={
             200: CitySerializer,
         },
         summary='Список городов России',
-        description='Возвращает список городов России',
+        description='Возвращает список городов России. С параметром since возвращает только изменения '
+                    'после указанной версии каталога (или весь список, если клиент слишком отстал)',
     ),
 )
 class CityListView(generics.ListAPIView):
     serializer_class = CitySerializer
     permission_classes = [IsAuthenticated, ]
     pagination_class = None
+    user_projection = 'identity'
     queryset = City.objects.all()
 
+    def list(self, request, *args, **kwargs):
+        serializer = CityDeltaQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        if 'since' in serializer.validated_data:
+            return city_catalogue.delta_response(serializer.validated_data['since'])
+        return city_catalogue.response(request)
+
+
+class CitySearchView(APIView):
+    permission_classes = [IsAuthenticated, ]
+    http_method_names = ['get']
+    user_projection = 'identity'
+
+    @extend_schema(
+        parameters=[CitySearchQuerySerializer],
+        responses={
+            200: CitySerializer(many=True),
+        },
+        summary='Поиск города',
+        description='Возвращает города, название которых начинается с запроса или похоже на него',
+    )
+    def get(self, request):
+        serializer = CitySearchQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        cities = city_search.search(serializer.validated_data['q'], serializer.validated_data['limit'])
+        return Response([{'id': pk, 'name': name} for pk, name in cities])
+
+
+class CityNearestView(APIView):
+    permission_classes = [IsAuthenticated, ]
+    http_method_names = ['get']
+    user_projection = 'identity'
+
+    @extend_schema(
+        parameters=[CityNearestQuerySerializer],
+        responses={
+            200: CityDistanceSerializer(many=True),
+        },
+        summary='Ближайший город',
+        description='Возвращает ближайшие к указанным координатам города, ближайший первым',
+    )
+    def get(self, request):
+        serializer = CityNearestQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        cities = city_nearest.nearest(
+            serializer.validated_data['lat'],
+            serializer.validated_data['lon'],
+            serializer.validated_data['limit'],
+        )
+        return Response([
+            {'id': pk, 'name': name, 'distance_km': round(distance, 3)}
+            for pk, name, distance in cities
+        ])
+
 
 @extend_schema_view(
     get=extend_schema(
@@ -55,10 +149,14 @@ class CityListView(generics.ListAPIView):
 class UserRetrieveView(generics.RetrieveAPIView):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, ]
+    user_projection = 'profile'
 
     def get_object(self):
         return self.request.user
 
+    def retrieve(self, request, *args, **kwargs):
+        return Response(get_cached_profile(request))
+
 
 @extend_schema_view(
     update=extend_schema(
@@ -72,6 +170,8 @@ class UserNameUpdateView(generics.UpdateAPIView):
     serializer_class = UserNameSerializer
     permission_classes = [IsAuthenticated, ]
     http_method_names = ["put"]
+    user_projection = 'profile'
+    rate_limits = {'PUT': (('profile-write-user', 'user'),)}
 
     def get_object(self):
         return self.request.user
@@ -89,6 +189,8 @@ class UserCityUpdateView(generics.UpdateAPIView):
     serializer_class = UserCitySerializer
     permission_classes = [IsAuthenticated, ]
     http_method_names = ["put"]
+    user_projection = 'profile'
+    rate_limits = {'PUT': (('profile-write-user', 'user'),)}
 
     def get_object(self):
         return self.request.user
@@ -108,6 +210,8 @@ class UserCityUpdateView(generics.UpdateAPIView):
 class UserBirthdayAPIView(APIView):
     http_method_names = ['post']
     permission_classes = [IsAuthenticated, ]
+    user_projection = 'profile'
+    rate_limits = {'POST': (('profile-write-user', 'user'),)}
 
     @extend_schema(
         request=UserBirthdaySerializer,
@@ -129,35 +233,60 @@ class UserBirthdayAPIView(APIView):
 
 class UserPhoneUpdateView(APIView):
     permission_classes = [IsAuthenticated, ]
-    http_method_names = ["post", "put"]
+    http_method_names = ["get", "post", "put"]
+    rate_limits = {
+        'POST': (('otp-request-user', 'user'), ('otp-request-phone', 'phone'), ('otp-request-ip', 'ip')),
+        'PUT': (('otp-verify-user', 'user'),),
+    }
 
     @staticmethod
     def get_otp():
         return "".join(SystemRandom().choice('123456789') for _ in range(settings.SMS_VERIFICATOIN_CODE_DIGITS))
 
+    @extend_schema(
+        responses={
+            200: SmsDeliveryStatusSerializer,
+        },
+        summary='Статус доставки кода подтверждения',
+        description='Возвращает статус доставки последнего запрошенного otp кода',
+    )
+    def get(self, request):
+        service = SmsVerificationService(request.user)
+        return Response(SmsDeliveryStatusSerializer(service.get_delivery_status()).data)
+
+    def check_throttles(self, request):
+        # repeats are answered with the first response and send no SMS, so they are not limited
+        if request.method == 'POST' and idempotent_requests.is_repeated(request):
+            return
+        super().check_throttles(request)
+
     @extend_schema(
         request=UserPhoneSerializer,
+        parameters=[
+            OpenApiParameter(
+                'Idempotency-Key', OpenApiTypes.STR, OpenApiParameter.HEADER,
+                description='Повторный запрос с тем же ключом вернёт первый ответ без отправки нового SMS',
+            ),
+        ],
         responses={
             200: {},
         },
         summary='Запросить код подтверждения',
-        description='Отправляет otp код на указанный номер телефона',
+        description='Ставит otp код в очередь на отправку на указанный номер телефона',
     )
     def post(self, request):
+        return idempotent_requests.respond(request, lambda: self.request_verification(request))
+
+    @staticmethod
+    def request_verification(request):
         serializer = UserPhoneSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        try:
-            service = SmsVerificationService(request.user)
-            verification_code = service.request_verification(
-                code=serializer.data['code'],
-                number=serializer.data['number'],
-            )
-        except exceptions.SmsDeliveryError as e:
-            raise APIException(
-                detail=str(e),
-                code='sms_delivery_failed'
-            )
+        service = SmsVerificationService(request.user)
+        verification_code = service.request_verification(
+            code=serializer.data['code'],
+            number=serializer.data['number'],
+        )
 
         # TODO: remove otp from response, for debug only
         return Response(data={"otp": verification_code},status=status.HTTP_200_OK)
@@ -184,6 +313,93 @@ class UserPhoneUpdateView(APIView):
         return Response(result)
 
 
+class SmsDeliveryCallbackView(APIView):
+    """
+    sms.ru status callback, authenticated by the shared token in the URL.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny, ]
+    http_method_names = ['post']
+
+    @extend_schema(
+        parameters=[OpenApiParameter('token', OpenApiTypes.STR, OpenApiParameter.QUERY)],
+        request={'application/x-www-form-urlencoded': OpenApiTypes.OBJECT},
+        responses={
+            200: OpenApiTypes.STR,
+        },
+        summary='Статусы доставки SMS от sms.ru',
+        description='Принимает пачку статусов в полях data[] и отвечает 100, как требует sms.ru',
+    )
+    def post(self, request):
+        token = request.query_params.get('token', '')
+        if not settings.SMS_RU_CALLBACK_TOKEN or not hmac.compare_digest(token, settings.SMS_RU_CALLBACK_TOKEN):
+            raise PermissionDenied()
+
+        reports, _ = parse_callback(request.data.getlist('data[]'), settings.SMS_RU_CALLBACK_MAX_ENTRIES)
+        record_reports(reports)
+        # any other answer makes sms.ru repeat the callback
+        return HttpResponse('100', content_type='text/plain')
+
+
+class UserProvisionView(APIView):
+    """
+    Bulk onboarding for the bot, authenticated by the internal service token.
+    """
+    authentication_classes = []
+    permission_classes = [IsInternalService, ]
+    http_method_names = ['post']
+
+    @extend_schema(
+        parameters=[OpenApiParameter('X-Service-Token', OpenApiTypes.STR, OpenApiParameter.HEADER, required=True)],
+        request=UserProvisionSerializer,
+        responses={
+            200: UserProvisionResultSerializer,
+        },
+        summary='Массовое создание пользователей',
+        description='Создаёт пользователей для telegram_id, которых ещё нет, и возвращает созданные и уже существующие id',
+    )
+    def post(self, request):
+        serializer = UserProvisionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created, existing = User.objects.provision(serializer.validated_data['telegram_ids'])
+        return Response(UserProvisionResultSerializer({'created': created, 'existing': existing}).data)
+
+
+class UserLookupView(APIView):
+    """
+    Profiles of many users for internal services, authenticated by the internal service token.
+
+    With ``Accept: application/x-ndjson`` the profiles are streamed as JSON
+    lines, one chunk of ``USER_LOOKUP_CHUNK_SIZE`` users at a time.
+    """
+    authentication_classes = []
+    permission_classes = [IsInternalService, ]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, JSONLinesRenderer]
+    http_method_names = ['post']
+
+    @extend_schema(
+        parameters=[OpenApiParameter('X-Service-Token', OpenApiTypes.STR, OpenApiParameter.HEADER, required=True)],
+        request=UserLookupSerializer,
+        responses={
+            200: UserSerializer(many=True),
+        },
+        summary='Профили пользователей по telegram_id',
+        description='Возвращает профили найденных пользователей в порядке запроса, неизвестные telegram_id пропускаются. '
+                    'С заголовком Accept: application/x-ndjson профили отдаются потоком, по одному JSON на строку',
+    )
+    def post(self, request):
+        serializer = UserLookupSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        chunks = iter_profiles(serializer.validated_data['telegram_ids'], settings.USER_LOOKUP_CHUNK_SIZE)
+        context = {'request': request}
+
+        renderer = request.accepted_renderer
+        if isinstance(renderer, JSONLinesRenderer):
+            lines = (renderer.render(UserSerializer(users, many=True, context=context).data) for users in chunks)
+            return StreamingHttpResponse(lines, content_type=renderer.media_type)
+        return Response([profile for users in chunks for profile in UserSerializer(users, many=True, context=context).data])
+
+
 @extend_schema_view(
     get=extend_schema(
         responses={
@@ -195,6 +411,40 @@ class UserPhoneUpdateView(APIView):
 class TechSupportAPIView(generics.RetrieveAPIView):
     serializer_class = BotUrlSerializer
     permission_classes = [IsAuthenticated, ]
+    user_projection = 'identity'
 
     def get_object(self):
         return {'url': settings.TECHSUPPORT_BOT_URL}
+
+
+class BootstrapAPIView(APIView):
+    permission_classes = [IsAuthenticated, ]
+    http_method_names = ['get']
+    user_projection = 'profile'
+
+    @extend_schema(
+        parameters=[BootstrapQuerySerializer],
+        responses={
+            200: BootstrapSerializer,
+        },
+        summary='Данные для запуска мини-приложения',
+        description='Возвращает профиль пользователя, ссылку на бота поддержки и состояние каталога городов. '
+                    'Список городов включается, только если cities_etag не совпадает с актуальным',
+    )
+    def get(self, request):
+        serializer = BootstrapQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        user = get_cached_profile(request)
+        snapshot = city_catalogue.get_snapshot()
+        fresh = snapshot.has_etag(serializer.validated_data.get('cities_etag'))
+
+        return Response({
+            'user': user,
+            'tech_support': {'url': settings.TECHSUPPORT_BOT_URL},
+            'cities': {
+                'version': snapshot.dataset_version,
+                'etag': snapshot.etag,
+                'items': None if fresh else snapshot.data,
+            },
+        })
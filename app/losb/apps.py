@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LosbConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'losb'
+
+    def ready(self):
+        from losb import checks, signals  # noqa: F401
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+from losb.api.v1.services.counters import is_process_local
+
+# state every worker has to see: OTP codes, version counters, pins, limits and replayed responses
+SHARED_CACHE_SETTINGS = (
+    'SMS_VERIFICATION_CACHE_ALIAS',
+    'PROFILE_CACHE_ALIAS',
+    'AUTH_USER_FILTER_CACHE_ALIAS',
+    'CITY_CATALOGUE_CACHE_ALIAS',
+    'DATABASE_REPLICA_PIN_CACHE_ALIAS',
+    'RATE_LIMIT_CACHE_ALIAS',
+    'IDEMPOTENCY_CACHE_ALIAS',
+)
+
+
+@register('caches')
+def check_shared_caches(app_configs, **kwargs):
+    # a warning, not an error: single-process runs and the test suite work on locmem
+    if settings.DEBUG:
+        return []
+    return [
+        Warning(
+            f'{name} points to the process-local cache {getattr(settings, name)!r}, '
+            f'workers will not see each other\'s state.',
+            hint='Set CACHE_URL to a cache shared by all workers, e.g. redis://.',
+            id='losb.W001',
+        )
+        for name in SHARED_CACHE_SETTINGS
+        if is_process_local(getattr(settings, name))
+    ]
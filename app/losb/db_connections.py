@@ -0,0 +1,49 @@
+import threading
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class ConnectionMetrics:
+    """
+    Connection counters of the process per database alias.
+
+    ``connects`` counts connections handed to Django: new server connections
+    without a pool, checkouts with one. Pooled aliases add the psycopg pool
+    statistics, ``saturation`` being the share of ``max_size`` in use.
+    """
+
+    def __init__(self):
+        self.connects = Counter()
+        self._lock = threading.Lock()
+
+    def record_connect(self, alias: str):
+        with self._lock:
+            self.connects[alias] += 1
+
+    def stats(self, alias: str = DEFAULT_DB_ALIAS) -> dict:
+        connection = connections[alias]
+        stats = {'connects': self.connects[alias], 'pooled': is_pooled(alias)}
+        if stats['pooled']:
+            pool = connection.pool
+            pool_stats = pool.get_stats()
+            in_use = pool_stats['pool_size'] - pool_stats['pool_available']
+            stats.update(
+                pool_size=pool_stats['pool_size'],
+                pool_max_size=pool.max_size,
+                in_use=in_use,
+                saturation=in_use / pool.max_size,
+                waiting=pool_stats.get('requests_waiting', 0),
+                wait_ms=pool_stats.get('requests_wait_ms', 0),
+                timeouts=pool_stats.get('requests_errors', 0),
+                server_connects=pool_stats.get('connections_num', 0),
+            )
+        return stats
+
+
+def is_pooled(alias: str = DEFAULT_DB_ALIAS) -> bool:
+    connection = connections[alias]
+    return connection.vendor == 'postgresql' and bool(connection.settings_dict['OPTIONS'].get('pool'))
+
+
+connection_metrics = ConnectionMetrics()
@@ -0,0 +1,157 @@
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# whether reads of the current request may go to a replica; unset outside requests (commands, workers)
+use_replica: ContextVar[bool] = ContextVar('use_replica', default=False)
+
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+class ReplicaPool:
+    """
+    Read replicas of the process with their last known health.
+
+    A replica is probed at most every ``check_interval`` seconds, in the
+    request that needs it: it must answer and, on PostgreSQL, not lag more
+    than ``max_lag`` seconds behind the primary. Unhealthy replicas are
+    skipped until the next probe; with none left reads go to the primary.
+
+    The age of the last replayed transaction only counts while WAL is still
+    waiting to be replayed: on an idle primary it grows without any lag.
+    """
+    LAG_QUERY = '''
+        SELECT CASE
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    '''
+
+    def __init__(self, aliases, check_interval: float, max_lag: float):
+        self.aliases = list(aliases)
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._health = {alias: (True, float('-inf')) for alias in self.aliases}  # alias -> (healthy, checked at)
+        self._lock = threading.Lock()
+
+    def pick(self) -> str:
+        healthy = [alias for alias in self.aliases if self.is_healthy(alias)]
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def is_healthy(self, alias: str) -> bool:
+        healthy, checked_at = self._health[alias]
+        now = time.monotonic()
+        if now - checked_at < self.check_interval:
+            return healthy
+        with self._lock:
+            if now - self._health[alias][1] < self.check_interval:
+                return self._health[alias][0]
+            # claim the probe first so concurrent requests keep the old verdict meanwhile
+            self._health[alias] = (healthy, now)
+        healthy = self.probe(alias)
+        self._health[alias] = (healthy, time.monotonic())
+        return healthy
+
+    def probe(self, alias: str) -> bool:
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(self.LAG_QUERY)
+                    return cursor.fetchone()[0] <= self.max_lag
+                cursor.execute('SELECT 1')
+                return True
+        except DatabaseError:
+            connection.close()
+            return False
+
+    def stats(self) -> dict:
+        return {alias: healthy for alias, (healthy, _) in self._health.items()}
+
+
+replica_pool = ReplicaPool(
+    aliases=[alias for alias in settings.DATABASES if alias.startswith('replica_')],
+    check_interval=settings.DATABASE_REPLICA_CHECK_INTERVAL,
+    max_lag=settings.DATABASE_REPLICA_MAX_LAG,
+)
+
+
+class ReplicaRouter:
+    """
+    Sends reads of safe, unpinned requests to a healthy replica and
+    everything else, including reads inside transactions, to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not replica_pool.aliases or not use_replica.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica_pool.pick()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+
+class PrimaryPins:
+    """
+    Short per-user pins to the primary after a write, so the user reads their
+    own change even while replicas still lag behind. Shared through ``CACHES``.
+    """
+
+    def __init__(self, alias: str, timeout: int):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _key(telegram_id) -> str:
+        return f'losb:db:pin:{telegram_id}'
+
+    def pin(self, telegram_id):
+        self.cache.set(self._key(telegram_id), True, timeout=self.timeout)
+
+    def is_pinned(self, telegram_id) -> bool:
+        return self.cache.get(self._key(telegram_id)) is not None
+
+
+primary_pins = PrimaryPins(
+    alias=settings.DATABASE_REPLICA_PIN_CACHE_ALIAS,
+    timeout=settings.DATABASE_REPLICA_PIN_SECONDS,
+)
+
+
+def route_user_reads(telegram_id):
+    """
+    Called by authentication before loading the user: pinned users read from the primary.
+    """
+    if use_replica.get() and primary_pins.is_pinned(telegram_id):
+        use_replica.set(False)
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = use_replica.set(bool(replica_pool.aliases) and request.method in SAFE_METHODS)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+
+        user = getattr(request, 'user', None)
+        if (request.method not in SAFE_METHODS and response.status_code < 400
+                and replica_pool.aliases and user is not None and user.is_authenticated):
+            primary_pins.pin(user.telegram_id)
+        return response
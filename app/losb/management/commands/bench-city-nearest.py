@@ -0,0 +1,42 @@
+import math
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from losb.api.v1.services.city_nearest import CityKDTree
+
+
+class Command(BaseCommand):
+    help = 'Measure nearest-city lookups on synthetic catalogues of growing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 300_000])
+        parser.add_argument('--queries', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        queries = [self._random_point(rng) for _ in range(options['queries'])]
+
+        for size in options['sizes']:
+            cities = [(pk, str(pk), *self._random_point(rng)) for pk in range(size)]
+            started = time.perf_counter()
+            tree = CityKDTree(cities)
+            built = time.perf_counter() - started
+
+            samples = []
+            for latitude, longitude in queries:
+                started = time.perf_counter()
+                tree.nearest(latitude, longitude)
+                samples.append((time.perf_counter() - started) * 1_000_000)
+            samples.sort()
+            self.stdout.write(
+                f'{size:>8} cities: build {built:6.2f} s, query mean {statistics.fmean(samples):7.1f} us, '
+                f'p50 {samples[len(samples) // 2]:7.1f} us, p99 {samples[int(len(samples) * 0.99)]:7.1f} us'
+            )
+
+    @staticmethod
+    def _random_point(rng):
+        # uniform over the sphere, not over the lat/lon rectangle
+        return math.degrees(math.asin(rng.uniform(-1, 1))), rng.uniform(-180, 180)
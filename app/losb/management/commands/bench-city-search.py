@@ -0,0 +1,49 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from losb.api.v1.services.city_search import CityIndex
+from losb.models import City
+
+
+class Command(BaseCommand):
+    help = 'Compare the in-memory city search index against name__icontains'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--limit', type=int, default=10)
+
+    def handle(self, *args, **options):
+        cities = list(City.objects.order_by('pk').values_list('pk', 'name'))
+        if not cities:
+            self.stderr.write('No cities to search, run populate-cities first')
+            return
+
+        started = time.perf_counter()
+        index = CityIndex(cities)
+        self.stdout.write(f'Indexed {len(index)} cities in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+        rng = random.Random(0)
+        queries = [name[:rng.randint(2, max(2, len(name)))] for _, name in rng.choices(cities, k=options['queries'])]
+        limit = options['limit']
+
+        self._report('index', [self._timed(index.search, query, limit) for query in queries])
+        self._report('icontains', [
+            self._timed(lambda q: list(City.objects.filter(name__icontains=q).values_list('name', flat=True)[:limit]), query)
+            for query in queries
+        ])
+
+    @staticmethod
+    def _timed(func, *args):
+        started = time.perf_counter()
+        func(*args)
+        return (time.perf_counter() - started) * 1_000_000
+
+    def _report(self, label, samples):
+        samples.sort()
+        self.stdout.write(
+            f'{label:>10}: mean {statistics.fmean(samples):8.1f} us, '
+            f'p50 {samples[len(samples) // 2]:8.1f} us, p99 {samples[int(len(samples) * 0.99)]:8.1f} us'
+        )
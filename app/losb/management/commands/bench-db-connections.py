@@ -0,0 +1,101 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from losb.db_connections import connection_metrics, is_pooled
+from losb.models import User
+
+MODES = ('none', 'persistent', 'pool')
+
+
+class Command(BaseCommand):
+    help = 'Measure requests per second of the auth lookup without connection reuse, with persistent connections and with a pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES, action='append', help='defaults to every mode the database supports')
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--pool-size', type=int, default=8)
+
+    def handle(self, *args, **options):
+        database = connections[DEFAULT_DB_ALIAS].settings_dict
+        modes = options['mode'] or [mode for mode in MODES if mode != 'pool' or database['ENGINE'].endswith('postgresql')]
+        if 'pool' in modes and not database['ENGINE'].endswith('postgresql'):
+            raise CommandError('Pooling needs PostgreSQL with psycopg 3')
+
+        user = User.objects.create(telegram_id=f'bench-db-{time.time_ns()}', name='bench')
+        original = {key: database[key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS', 'OPTIONS')}
+        try:
+            for mode in modes:
+                self._configure(database, mode, options['pool_size'])
+                self._run(mode, user.telegram_id, options['threads'], options['requests'])
+        finally:
+            self._configure(database, None, 0)
+            database.update(original)
+            user.delete()
+
+    @staticmethod
+    def _configure(database: dict, mode, pool_size: int):
+        """
+        Connection settings are shared by the connection of every thread, so
+        the benchmark threads started afterwards pick the mode up.
+        """
+        if is_pooled():
+            connections[DEFAULT_DB_ALIAS].close_pool()
+        connections.close_all()
+        options = {key: value for key, value in database['OPTIONS'].items() if key != 'pool'}
+        if mode == 'pool':
+            options['pool'] = {'min_size': pool_size, 'max_size': pool_size, 'timeout': 30}
+        database.update(CONN_MAX_AGE=600 if mode == 'persistent' else 0, CONN_HEALTH_CHECKS=True, OPTIONS=options)
+
+    def _run(self, mode: str, telegram_id: str, threads: int, requests: int):
+        connects = connection_metrics.stats()['connects']
+        peak = {'in_use': 0, 'waiting': 0}
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.01):
+                stats = connection_metrics.stats()
+                peak['in_use'] = max(peak['in_use'], stats['in_use'])
+                peak['waiting'] = max(peak['waiting'], stats['waiting'])
+
+        def serve(count: int):
+            try:
+                for _ in range(count):
+                    # the request cycle as the handler runs it, the signals close connections that are not reused
+                    request_started.send(sender=self.__class__)
+                    try:
+                        User.objects.projected('identity').get(telegram_id=telegram_id)
+                    finally:
+                        request_finished.send(sender=self.__class__)
+            finally:
+                connections.close_all()
+
+        sampler = threading.Thread(target=sample) if mode == 'pool' else None
+        if sampler:
+            sampler.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            share, rest = divmod(requests, threads)
+            for _ in executor.map(serve, [share + (i < rest) for i in range(threads)]):
+                pass
+        elapsed = time.perf_counter() - started
+        done.set()
+        if sampler:
+            sampler.join()
+
+        stats = connection_metrics.stats()
+        line = (
+            f'{mode:>10}: {requests / elapsed:,.0f} req/s, {elapsed / requests * 1000:.2f} ms per request, '
+            f'{stats["connects"] - connects} connects'
+        )
+        if mode == 'pool':
+            line += (
+                f', pool peak {peak["in_use"]}/{stats["pool_max_size"]} in use, {peak["waiting"]} waiting, '
+                f'{stats["wait_ms"]} ms waited, {stats["timeouts"]} timeouts, {stats["server_connects"]} server connects'
+            )
+        self.stdout.write(line)
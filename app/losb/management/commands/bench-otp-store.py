@@ -0,0 +1,63 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from losb.api.v1 import exceptions
+from losb.api.v1.services.otp_store import CacheOtpStore, ModelOtpStore
+from losb.api.v1.services.sms_verification import SmsVerificationService
+from losb.models import User
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = 'Compare database writes of OTP stores over request, wrong guesses and verification'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flows', type=int, default=200)
+        parser.add_argument('--wrong-guesses', type=int, default=2)
+
+    def handle(self, *args, **options):
+        for store in (ModelOtpStore(), CacheOtpStore()):
+            statements = Counter()
+
+            def count(execute, sql, params, many, context):
+                statements[sql.lstrip().split(' ', 1)[0].upper()] += 1
+                return execute(sql, params, many, context)
+
+            started = time.perf_counter()
+            with transaction.atomic():
+                users = self._users(options['flows'])
+                with connection.execute_wrapper(count):
+                    for i, user in enumerate(users):
+                        self._flow(SmsVerificationService(user, store=store), f'999{i:07d}', options['wrong_guesses'])
+                transaction.set_rollback(True)
+            elapsed = time.perf_counter() - started
+
+            flows = options['flows']
+            writes = sum(statements[kind] for kind in WRITES)
+            breakdown = ', '.join(f'{kind.lower()} {statements[kind] / flows:.1f}' for kind in WRITES)
+            self.stdout.write(
+                f'{type(store).__name__:>14}: {writes / flows:.1f} writes per flow ({breakdown}), '
+                f'{statements["SELECT"] / flows:.1f} selects, {elapsed / flows * 1000:.2f} ms per flow'
+            )
+
+    @staticmethod
+    def _users(count: int) -> list[User]:
+        suffix = time.time_ns()
+        return [
+            User.objects.create(telegram_id=f'bench-otp-{suffix}-{i}', name='bench')
+            for i in range(count)
+        ]
+
+    @staticmethod
+    def _flow(service: SmsVerificationService, number: str, wrong_guesses: int):
+        otp = service.request_verification(code='7', number=number)
+        for _ in range(wrong_guesses):
+            try:
+                service.verify_code(otp='0', code='7', number=number)
+            except exceptions.SmsVerificationFailed:
+                pass
+        service.verify_code(otp=otp, code='7', number=number)
@@ -0,0 +1,50 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from losb.api.v1.services.phone_numbers import InvalidPhoneNumber, parse_phone
+
+FORMATS = (
+    '{number}',
+    '8{number}',
+    '+7{number}',
+    '8 ({a}) {b}-{c}-{d}',
+    '+7 {a} {b} {c} {d}',
+    '{a}-{b}-{c}{d}',
+)
+
+
+class Command(BaseCommand):
+    help = 'Measure phone number normalisation throughput on synthetic input'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1_000_000)
+        parser.add_argument('--invalid-share', type=float, default=0.05)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        inputs = [self._random_input(rng, options['invalid_share']) for _ in range(options['count'])]
+
+        valid = invalid = 0
+        started = time.perf_counter()
+        for code, number in inputs:
+            try:
+                parse_phone(code, number)
+                valid += 1
+            except InvalidPhoneNumber:
+                invalid += 1
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'{len(inputs)} numbers in {elapsed:.2f} s: {len(inputs) / elapsed * 60 / 1_000_000:.1f} M/min, '
+            f'{elapsed / len(inputs) * 1_000_000:.2f} us each, {valid} valid, {invalid} invalid'
+        )
+
+    @staticmethod
+    def _random_input(rng, invalid_share: float) -> tuple[str, str]:
+        number = f'9{rng.randrange(10 ** 9):09d}'
+        if rng.random() < invalid_share:
+            number = number[:rng.randint(3, 9)]
+        a, b, c, d = number[:3], number[3:6], number[6:8], number[8:]
+        return rng.choice(('7', '+7')), rng.choice(FORMATS).format(number=number, a=a, b=b, c=c, d=d)
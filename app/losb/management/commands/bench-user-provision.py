@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from losb.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measure bulk user provisioning against create_user one by one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='telegram_ids per provision call')
+        parser.add_argument('--calls', type=int, default=3)
+        parser.add_argument('--existing-share', type=float, default=0.2,
+                            help='share of every call that was provisioned by the previous one')
+        parser.add_argument('--one-by-one', type=int, default=200, help='users created with create_user for comparison')
+
+    def handle(self, *args, **options):
+        prefix = f'bench-provision-{time.time_ns()}'
+        users = options['users']
+        overlap = int(users * options['existing_share'])
+        try:
+            started = time.perf_counter()
+            for i in range(options['one_by_one']):
+                User.objects.create_user(f'{prefix}-single-{i}', None, name='')
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'create_user: {options["one_by_one"] / elapsed:,.0f} users/s, {elapsed / options["one_by_one"] * 1000:.2f} ms per user')
+
+            offset = 0
+            for call in range(options['calls']):
+                telegram_ids = [f'{prefix}-{i}' for i in range(offset, offset + users)]
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    created, existing = User.objects.provision(telegram_ids)
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'provision call {call + 1}: {users} ids in {elapsed:.2f} s, {users / elapsed:,.0f} users/s, '
+                    f'{len(created)} created, {len(existing)} existing, {len(queries)} queries'
+                )
+                offset += users - overlap
+        finally:
+            User.objects.filter(telegram_id__startswith=prefix).delete()
@@ -1,18 +1,108 @@
 import csv
 import os
+import time
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
 from app.settings import BASE_DIR
-from losb.models import City
+from losb.api.v1.services.city_catalogue import city_catalogue
+from losb.models import City, CityChange
 
 
 class Command(BaseCommand):
+    help = 'Import cities from a CSV file, skipping names that already exist'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=os.path.join(BASE_DIR, 'cities.csv'))
+        parser.add_argument('--column', type=int, default=2, help='Index of the column holding the city name')
+        parser.add_argument('--lat-column', type=int, help='Index of the column holding the latitude')
+        parser.add_argument('--lon-column', type=int, help='Index of the column holding the longitude')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be inserted without writing')
+
     def handle(self, *args, **options):
-        #TODO: Check what happens when file doesn't exist
-        with open(os.path.join(BASE_DIR, 'cities.csv')) as f:
+        path = options['file']
+        column = options['column']
+        lat_column, lon_column = options['lat_column'], options['lon_column']
+        with_coordinates = lat_column is not None and lon_column is not None
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+        if not os.path.isfile(path):
+            raise CommandError(f'Cities file not found: {path}')
+
+        if (lat_column is None) != (lon_column is None):
+            raise CommandError('--lat-column and --lon-column must be given together')
+
+        known = {
+            name: (pk, latitude, longitude)
+            for name, pk, latitude, longitude in City.objects.values_list(
+                'name', 'pk', 'latitude', 'longitude',
+            ).iterator(chunk_size=batch_size)
+        }
+        started = time.perf_counter()
+        read = inserted = updated = 0
+
+        with open(path, newline='', encoding='utf-8') as f:
             reader = csv.reader(f)
-            for row in reader:
-                city, created = City.objects.get_or_create(
-                    name=row[2]
+            while chunk := list(islice(reader, batch_size)):
+                read += len(chunk)
+                batch, moved = [], []
+                for row in chunk:
+                    name = row[column].strip() if len(row) > column else ''
+                    if not name:
+                        continue
+                    latitude = longitude = None
+                    if with_coordinates:
+                        latitude = self._coordinate(row, lat_column, 90)
+                        longitude = self._coordinate(row, lon_column, 180)
+                        if latitude is None or longitude is None:
+                            latitude = longitude = None
+                    if name not in known:
+                        known[name] = (None, latitude, longitude)
+                        batch.append(City(name=name, latitude=latitude, longitude=longitude))
+                    elif latitude is not None:
+                        pk, known_latitude, known_longitude = known[name]
+                        if pk is not None and (known_latitude, known_longitude) != (latitude, longitude):
+                            known[name] = (pk, latitude, longitude)
+                            moved.append(City(pk=pk, latitude=latitude, longitude=longitude))
+
+                if (batch or moved) and not options['dry_run']:
+                    with transaction.atomic():
+                        names = [city.name for city in batch]
+                        # another writer may have added some of them since ``known`` was read
+                        existing = set(City.objects.filter(name__in=names).values_list('name', flat=True))
+                        City.objects.bulk_create(batch, ignore_conflicts=True)
+                        # ignore_conflicts leaves pks unset, read them back for the change log
+                        created = [
+                            city for city in City.objects.filter(name__in=names).only('pk', 'name')
+                            if city.name not in existing
+                        ]
+                        CityChange.record(CityChange.Action.INSERT, created)
+                        City.objects.bulk_update(moved, ['latitude', 'longitude'])
+                inserted += len(batch)
+                updated += len(moved)
+
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{read} rows read, {inserted} new cities, {updated} relocated, {read / elapsed:.0f} rows/s'
                 )
+
+        if (inserted or updated) and not options['dry_run']:
+            city_catalogue.invalidate()
+
+        verb = 'Would insert' if options['dry_run'] else 'Inserted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {inserted} cities and update coordinates of {updated} from {read} rows '
+            f'in {time.perf_counter() - started:.2f} s'
+        ))
+
+    @staticmethod
+    def _coordinate(row, column, limit):
+        try:
+            value = float(row[column])
+        except (IndexError, ValueError):
+            return None
+        return value if -limit <= value <= limit else None
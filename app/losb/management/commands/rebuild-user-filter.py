@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from losb.api.v1.services.user_filter import known_users
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Bloom filter of known telegram_ids in every worker'
+
+    def handle(self, *args, **options):
+        # workers load the published filter on the next miss after the epoch moves
+        known_users.rebuild()
+        stats = known_users.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt user filter: {stats['count']} users, {stats['bits']} bits, "
+            f"{stats['hash_count']} hashes, target false-positive rate {stats['false_positive_rate']}"
+        ))
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from losb.api.v1.services.maintenance import maintenance
+
+
+class Command(BaseCommand):
+    help = 'Run periodic maintenance jobs, such as purging expired SMS verifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', action='append', dest='jobs', help='Only run this job (repeatable)')
+        parser.add_argument('--budget', type=float, default=settings.MAINTENANCE_BUDGET,
+                            help='Seconds of work a job may do per run')
+        parser.add_argument('--batch-size', type=int, default=settings.MAINTENANCE_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Run every job once and exit')
+
+    def handle(self, *args, **options):
+        names = options['jobs']
+        unknown = set(names or ()) - set(maintenance.jobs)
+        if unknown:
+            raise CommandError(f"Unknown jobs: {', '.join(sorted(unknown))}. Known: {', '.join(maintenance.jobs)}")
+        if options['budget'] <= 0 or options['batch_size'] < 1:
+            raise CommandError('--budget and --batch-size must be positive')
+
+        try:
+            while True:
+                for run in maintenance.run_pending(options['budget'], options['batch_size'], names, force=options['once']):
+                    self.stdout.write(
+                        f'{run.name}: {run.rows} rows in {run.seconds:.2f} s, {run.rows_per_second:.0f} rows/s'
+                    )
+                if options['once']:
+                    break
+                time.sleep(maintenance.seconds_until_due(names))
+        except KeyboardInterrupt:
+            pass
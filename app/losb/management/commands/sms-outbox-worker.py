@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from losb.api.v1 import exceptions
+from losb.api.v1.services.sms_outbox import sms_outbox
+from losb.api.v1.services.sms_router import get_sms_sender
+from losb.api.v1.services.sms_sender import get_provider_message_id
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued SMS from the outbox, retrying failures and dead-lettering exhausted ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='Exit once the outbox is drained')
+
+    def handle(self, *args, **options):
+        sender = get_sms_sender()
+        sent = failed = lost = 0
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            try:
+                while True:
+                    rows = sms_outbox.claim(options['batch_size'], options['concurrency'])
+                    if not rows:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll_interval'])
+                        continue
+
+                    # only the HTTP calls run in threads, DB writes stay on this connection
+                    for row, (result, error) in zip(rows, executor.map(lambda row: self._send(sender, row), rows)):
+                        if error is None:
+                            settled = sms_outbox.mark_sent(row, get_provider_message_id(result))
+                            sent += 1
+                        else:
+                            settled = sms_outbox.mark_failed(row, error)
+                            failed += 1
+                        if not settled:
+                            lost += 1
+                    self.stdout.write(f'{sent} sent, {failed} failed attempts, {lost} settled by another claim')
+            except KeyboardInterrupt:
+                pass
+
+        self.stdout.write(self.style.SUCCESS(f'Stopped: {sent} sent, {failed} failed attempts'))
+
+    @staticmethod
+    def _send(sender, row):
+        try:
+            return sender.send_sms(row.phone, row.message), None
+        except exceptions.SmsDeliveryError as e:
+            return None, str(e.detail)
+        except Exception as e:
+            return None, f'{type(e).__name__}: {e}'
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('losb', '0001_squashed_0023_rename_avatar_user_avatar_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city_id', models.BigIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('action', models.CharField(choices=[('insert', 'Insert'), ('rename', 'Rename'), ('delete', 'Delete')], max_length=6)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
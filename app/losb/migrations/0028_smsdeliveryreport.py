@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('losb', '0027_alter_smsverification_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsDeliveryReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider_message_id', models.CharField(max_length=64, unique=True)),
+                ('status_code', models.SmallIntegerField()),
+                ('reported_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
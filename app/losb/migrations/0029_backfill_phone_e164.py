@@ -0,0 +1,94 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:32
+
+import re
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+# frozen copy of losb.api.v1.services.phone_numbers as of this migration,
+# so later changes to the live rules don't change what it backfills
+COUNTRY_RULES = (
+    ('7', r'[3489]\d{9}', '8'),
+    ('375', r'(?:1[5-7]|2[2-59]|33|44)\d{7}', '80'),
+    ('380', r'[3-9]\d{8}', '0'),
+    ('373', r'[2-8]\d{7}', '0'),
+    ('374', r'[1-9]\d{7}', '0'),
+    ('992', r'[3-9]\d{8}', ''),
+    ('993', r'[1-6]\d{7}', '8'),
+    ('994', r'[1-9]\d{8}', '0'),
+    ('995', r'[3-7]\d{8}', '0'),
+    ('996', r'[2-9]\d{8}', '0'),
+    ('998', r'[1-9]\d{8}', ''),
+    ('1', r'[2-9]\d{2}[2-9]\d{6}', '1'),
+    ('44', r'[1-9]\d{9}', '0'),
+    ('49', r'[1-9]\d{5,13}', '0'),
+    ('90', r'[2-5]\d{9}', '0'),
+    ('972', r'[2-9]\d{7,8}', '0'),
+)
+RULES = {code: (re.compile(pattern).fullmatch, trunk) for code, pattern, trunk in COUNTRY_RULES}
+FORMATTING = str.maketrans('', '', ' -().+ ')
+
+
+def to_e164(code, number):
+    """
+    ``+<code><number>`` for a valid number, None otherwise.
+    """
+    code, number = str(code).translate(FORMATTING), str(number).translate(FORMATTING)
+    if not (code + number).isascii() or not code.isdigit() or not number.isdigit() or code not in RULES:
+        return None
+    matches, trunk = RULES[code]
+    if not matches(number):
+        if number.startswith(code) and matches(number[len(code):]):
+            number = number[len(code):]
+        elif trunk and number.startswith(trunk) and matches(number[len(trunk):]):
+            number = number[len(trunk):]
+        else:
+            return None
+    return f'+{code}{number}'
+
+
+def backfill_e164(apps, schema_editor):
+    """
+    Fill e164 for numbers that normalise, in key ranges of BATCH_SIZE phones.
+
+    The migration is not atomic: every batch is its own short UPDATE, so only
+    the rows of one batch are locked at a time on a live table. Invalid
+    numbers and later duplicates of a number stay NULL, they get it the next
+    time they are verified.
+    """
+    Phone = apps.get_model('losb', 'Phone')
+    phones = Phone.objects.using(schema_editor.connection.alias)
+    # numbers verified since 0029_phone_e164 already carry theirs
+    seen = set(phones.filter(e164__isnull=False).values_list('e164', flat=True))
+
+    last_pk = 0
+    while True:
+        batch = list(phones.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        changed = []
+        for phone in batch:
+            if phone.e164 is not None or phone.number is None:
+                continue
+            e164 = to_e164(phone.code, phone.number)
+            if e164 is None or e164 in seen:
+                continue
+            seen.add(e164)
+            phone.e164 = e164
+            changed.append(phone)
+        # one UPDATE per batch, only for rows still without a number: a verification in the meantime wins
+        phones.filter(e164__isnull=True).bulk_update(changed, ['e164'])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('losb', '0029_phone_e164'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_e164, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('losb', '0028_smsdeliveryreport'),
+    ]
+
+    operations = [
+        # unique once filled, see 0029_phone_e164_unique
+        migrations.AddField(
+            model_name='phone',
+            name='e164',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('losb', '0029_phone_e164_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='phone_code',
+            field=models.CharField(default='7'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='phone_number',
+            field=models.CharField(blank=True, null=True),
+        ),
+        # unique once filled, see 0032
+        migrations.AddField(
+            model_name='user',
+            name='phone_e164',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='phone',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='user', to='losb.phone'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:05
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def copy_phones(apps, schema_editor):
+    """
+    Copy the phone rows onto their users in key ranges of BATCH_SIZE users.
+
+    The migration is not atomic: every batch is its own short UPDATE, so only
+    the rows of one batch are locked at a time on a live table.
+    """
+    User = apps.get_model('losb', 'User')
+    Phone = apps.get_model('losb', 'Phone')
+    users = User.objects.using(schema_editor.connection.alias)
+    phone = Phone.objects.using(schema_editor.connection.alias).filter(pk=OuterRef('phone_id'))
+
+    last_pk = 0
+    while True:
+        batch = list(users.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+        if not batch:
+            break
+        users.filter(pk__gt=last_pk, pk__lte=batch[-1], phone__isnull=False).update(
+            phone_code=Subquery(phone.values('code')[:1]),
+            phone_number=Subquery(phone.values('number')[:1]),
+            phone_e164=Subquery(phone.values('e164')[:1]),
+        )
+        last_pk = batch[-1]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('losb', '0030_user_phone_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_phones, migrations.RunPython.noop),
+    ]
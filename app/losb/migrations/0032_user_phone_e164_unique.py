@@ -0,0 +1,53 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+INDEX_NAME = 'losb_user_phone_e164_uniq'
+
+
+def create_unique_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {INDEX_NAME} ON losb_user (phone_e164)')
+        return
+
+    # a failed CONCURRENTLY build leaves an INVALID index behind that IF NOT EXISTS would keep
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s',
+            [INDEX_NAME],
+        )
+        row = cursor.fetchone()
+    if row and row[0]:
+        return
+    if row:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY {INDEX_NAME}')
+    # CONCURRENTLY keeps PostgreSQL accepting writes to the table while the index builds
+    schema_editor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY {INDEX_NAME} ON losb_user (phone_e164)')
+
+
+def drop_unique_index(apps, schema_editor):
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(f'DROP INDEX {concurrently}IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('losb', '0031_copy_phones_to_users'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_unique_index, drop_unique_index),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='user',
+                    name='phone_e164',
+                    field=models.CharField(blank=True, max_length=16, null=True, unique=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:05
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('losb', '0033_smsoutbox_expires_at_claim_token'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='citychange',
+            name='created_at',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now()),
+        ),
+    ]
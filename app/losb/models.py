@@ -1,44 +1,173 @@
+import secrets
+
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
 from django.contrib.auth.models import PermissionsMixin
+from django.db import transaction
 from django.db.models import CASCADE, PROTECT, SET_NULL
+from django.db.models.functions import Now
+from django.dispatch import Signal
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.db import models
 
 from app import settings
 from app.settings import SMS_VERIFICATOIN_CODE_DIGITS
 
+# sent with the telegram_ids created by ``CustomUserManager.provision``, bulk_create sends no post_save
+users_provisioned = Signal()
+
 
 class City(models.Model):
     name = models.CharField(max_length=255, unique=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
 
     def __str__(self):
         return f'{self.name}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the stored name, so saving only logs a rename when the name changed
+        if 'name' in field_names:
+            instance.saved_name = instance.name
+        return instance
+
+class CityChange(models.Model):
+    """
+    Append-only log of city catalogue changes, its id is the catalogue version.
+    """
+    class Action(models.TextChoices):
+        INSERT = 'insert'
+        RENAME = 'rename'
+        DELETE = 'delete'
+
+    city_id = models.BigIntegerField()
+    name = models.CharField(max_length=255)
+    action = models.CharField(max_length=6, choices=Action.choices)
+    # the database clock: the settle window is measured against it, whatever the workers' clocks say
+    created_at = models.DateTimeField(db_default=Now())
+
+    @classmethod
+    def record(cls, action, cities):
+        cls.objects.bulk_create([cls(city_id=city.pk, name=city.name, action=action) for city in cities])
+
 class SMSVerification(models.Model):
     otp = models.CharField(max_length=settings.SMS_VERIFICATOIN_CODE_DIGITS)
     attempts = models.SmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # built CONCURRENTLY by 0027, the purge job walks it oldest first
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+class SmsOutbox(models.Model):
+    """
+    SMS waiting to be delivered by the ``sms-outbox-worker`` command.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        SENDING = 'sending'
+        SENT = 'sent'
+        DEAD = 'dead'
+
+    verification = models.ForeignKey(SMSVerification, null=True, blank=True, on_delete=SET_NULL, related_name='outbox')
+    phone = models.CharField(max_length=32)
+    message = models.TextField()
+    status = models.CharField(max_length=8, choices=Status.choices, default=Status.PENDING)
+    attempts = models.SmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # not sent after this, e.g. once the code in the message can no longer be verified
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # set by every claim, settling a row needs the token of the claim that holds it
+    claim_token = models.UUIDField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    provider_message_id = models.CharField(max_length=255, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+class SmsDeliveryReport(models.Model):
+    """
+    Latest delivery status sms.ru reported for a sent message.
+
+    Kept apart from ``SmsOutbox`` so reports can be upserted in bulk by
+    provider message id, even when they arrive before the worker stored it.
+    """
+    class Status(models.IntegerChoices):
+        QUEUED = 100
+        SENDING = 101
+        SENT = 102
+        DELIVERED = 103
+        EXPIRED = 104
+        DELETED = 105
+        PHONE_FAILURE = 106
+        UNKNOWN_FAILURE = 107
+        REJECTED = 108
+        READ = 110
+        NO_ROUTE = 150
+
+    provider_message_id = models.CharField(max_length=64, unique=True)
+    status_code = models.SmallIntegerField()
+    reported_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
 class Phone(models.Model):
+    """
+    Deprecated: phones are read from ``User`` since 0031. This release still
+    gives every user a row here and writes verified numbers to both places, so
+    processes of the previous release keep working during the rollout. It and
+    ``User.phone`` are dropped in the next release, whose migration first runs
+    0031's copy again for the numbers those processes verified meanwhile.
+    """
     code = models.CharField()
-    number = models.CharField(null=True, blank=True) #TODO: should regex validation be added?
+    number = models.CharField(null=True, blank=True)
+    e164 = models.CharField(max_length=16, unique=True, null=True, blank=True)
 
     def __str__(self):
-        return f'+{self.code}{self.number if self.number else '-not-verified'}'
+        return f"+{self.code}{self.number if self.number else '-not-verified'}"
 
 class CustomUserManager(BaseUserManager):
     """
     Custom user model manager where email is the unique identifiers
     for authentication instead of usernames.
     """
+    # Named query shapes for the authentication path, views pick one via ``user_projection``
+    PROJECTIONS = {
+        'identity': {
+            'select_related': (),
+            'only': ('telegram_id',),
+        },
+        'profile': {
+            'select_related': ('location',),
+            'only': (
+                'telegram_id', 'name', 'avatar_url', 'birthday',
+                'phone_code', 'phone_number', 'location__name',
+            ),
+        },
+        'full': {
+            'select_related': ('location',),
+            'only': (),
+        },
+    }
+
     def create_user(self, telegram_id, password, **extra_fields):
         """
         Create and save a user with the given telegram_id and password.
         """
         if not telegram_id:
             raise ValueError(_("The telegram_id must be set"))
-        phone = Phone.objects.create(code=7)
-        user = self.model(telegram_id=telegram_id, phone=phone, **extra_fields)
+        # the previous release reads user.phone, see Phone
+        extra_fields.setdefault('phone', Phone.objects.create(code=extra_fields.get('phone_code', '7')))
+        user = self.model(telegram_id=telegram_id, **extra_fields)
         user.set_password(password)
         user.save()
         return user
@@ -55,9 +184,54 @@ class CustomUserManager(BaseUserManager):
         if extra_fields.get("is_superuser") is not True:
             raise ValueError(_("Superuser must have is_superuser=True."))
         return self.create_user(telegram_id, password, **extra_fields)
-    
-    def get(self, *args, **kwargs):
-        return super().select_related('phone', 'city').get(*args, **kwargs) #TODO: potentially add verification_code
+
+    def provision(self, telegram_ids, batch_size=1000) -> tuple[list[str], list[str]]:
+        """
+        Create users for the telegram_ids that do not exist yet, in bulk and
+        with unusable passwords: bot users never log in with a password.
+
+        Returns the created and the already existing telegram_ids. Every chunk
+        is inserted with ON CONFLICT DO NOTHING, so existing rows are neither
+        rewritten nor locked, then read back: a row carrying the random
+        password generated for it here is one this call created, even when
+        another caller provisions the same ids concurrently.
+        """
+        telegram_ids = list(dict.fromkeys(str(telegram_id) for telegram_id in telegram_ids))
+        created = set()
+        with transaction.atomic():
+            for start in range(0, len(telegram_ids), batch_size):
+                # what make_password(None) stores, without its per-character get_random_string
+                passwords = {
+                    telegram_id: UNUSABLE_PASSWORD_PREFIX + secrets.token_urlsafe(30)
+                    for telegram_id in telegram_ids[start:start + batch_size]
+                }
+                self.bulk_create(
+                    [self.model(telegram_id=telegram_id, name='', password=password)
+                     for telegram_id, password in passwords.items()],
+                    ignore_conflicts=True,
+                )
+                stored = self.filter(telegram_id__in=passwords).values_list('pk', 'telegram_id', 'password')
+                batch = {pk: telegram_id for pk, telegram_id, password in stored if passwords[telegram_id] == password}
+                created.update(batch.values())
+                # the previous release reads user.phone, see Phone
+                phones = Phone.objects.bulk_create([Phone(code='7') for _ in batch])
+                self.bulk_update([self.model(pk=pk, phone=phone) for pk, phone in zip(batch, phones)], ['phone'])
+            new_ids = [telegram_id for telegram_id in telegram_ids if telegram_id in created]
+            users_provisioned.send(sender=self.model, telegram_ids=new_ids)
+        return new_ids, [telegram_id for telegram_id in telegram_ids if telegram_id not in created]
+
+    def projected(self, projection):
+        """
+        Queryset loading only the columns and joins of the named projection.
+        """
+        shape = self.PROJECTIONS[projection]
+        queryset = self.get_queryset()
+        if shape['select_related']:
+            # an empty select_related() would follow every non-null foreign key
+            queryset = queryset.select_related(*shape['select_related'])
+        if shape['only']:
+            queryset = queryset.only(*shape['only'])
+        return queryset
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -65,7 +239,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     nickname = models.CharField(max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     name = models.CharField(max_length=255)
-    phone = models.ForeignKey(Phone, on_delete=CASCADE,related_name='user')
+    # deprecated, see Phone
+    phone = models.ForeignKey(Phone, null=True, on_delete=CASCADE, related_name='user')
+    # unverified until phone_number is set
+    phone_code = models.CharField(default='7')
+    phone_number = models.CharField(null=True, blank=True)
+    # canonical +<code><number>, set by the phone serializers once the number is validated
+    phone_e164 = models.CharField(max_length=16, unique=True, null=True, blank=True)
 
     sms_verification = models.ForeignKey(SMSVerification, null=True, blank=True, on_delete=SET_NULL,related_name='user')
     avatar_url = models.ImageField('Аватар', upload_to='user/avatar/', blank=True, null=True, max_length=512)
@@ -82,3 +262,10 @@ class User(AbstractBaseUser, PermissionsMixin):
     REQUIRED_FIELDS = []
 
     objects = CustomUserManager()
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        # touching a field a projection deferred loads all deferred fields in one query
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred and set(fields) <= deferred:
+            fields = deferred
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
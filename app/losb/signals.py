@@ -0,0 +1,86 @@
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from losb.api.v1.services.city_catalogue import city_catalogue
+from losb.api.v1.services.profile_cache import profile_cache
+from losb.api.v1.services.rate_limit import rate_limiter
+from losb.api.v1.services.user_cache import user_cache
+from losb.api.v1.services.user_filter import known_users
+from losb.db_connections import connection_metrics
+from losb.models import City, CityChange, SMSVerification, User, users_provisioned
+
+
+def _bump_profiles(*telegram_ids):
+    # bump after commit, otherwise a concurrent reader could cache the old row under the new version
+    for telegram_id in telegram_ids:
+        transaction.on_commit(lambda telegram_id=telegram_id: profile_cache.bump(telegram_id))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.telegram_id)
+    _bump_profiles(instance.telegram_id)
+
+
+@receiver(post_save, sender=User)
+def register_known_user(sender, instance, created, **kwargs):
+    known_users.add(instance.telegram_id)
+    if created:
+        transaction.on_commit(known_users.announce_created)
+
+
+@receiver(users_provisioned)
+def register_provisioned_users(sender, telegram_ids, **kwargs):
+    for telegram_id in telegram_ids:
+        known_users.add(telegram_id)
+    if telegram_ids:
+        transaction.on_commit(known_users.announce_created)
+
+
+@receiver(post_save, sender=City)
+def record_city_saved(sender, instance, created, **kwargs):
+    # saved_name is set by City.from_db, an instance not loaded from the database counts as renamed
+    if created:
+        CityChange.record(CityChange.Action.INSERT, [instance])
+    elif instance.name != getattr(instance, 'saved_name', None):
+        CityChange.record(CityChange.Action.RENAME, [instance])
+    instance.saved_name = instance.name
+
+
+@receiver(post_delete, sender=City)
+def record_city_deleted(sender, instance, **kwargs):
+    CityChange.record(CityChange.Action.DELETE, [instance])
+
+
+@receiver([post_save, post_delete], sender=City)
+def invalidate_cached_city_residents(sender, instance, **kwargs):
+    user_cache.invalidate_related('location_id', instance.pk)
+    transaction.on_commit(profile_cache.bump_all)
+    transaction.on_commit(city_catalogue.invalidate)
+
+
+@receiver(pre_delete, sender=SMSVerification)
+def collect_verification_owners(sender, instance, **kwargs):
+    instance.owner_telegram_ids = list(instance.user.values_list('telegram_id', flat=True))
+
+
+@receiver(post_delete, sender=SMSVerification)
+def invalidate_cached_verification_owner(sender, instance, **kwargs):
+    # User.sms_verification is SET_NULL via a bulk UPDATE that sends no post_save
+    user_cache.invalidate_related('sms_verification_id', instance.pk)
+    _bump_profiles(*getattr(instance, 'owner_telegram_ids', ()))
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    connection_metrics.record_connect(connection.alias)
+
+
+@receiver(setting_changed)
+def reload_rate_limits(sender, setting, value, **kwargs):
+    # lets tests loosen limits with override_settings
+    if setting == 'RATE_LIMITS':
+        rate_limiter.configure(value)
@@ -1,3 +1,1064 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import math
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import jwt
+import requests
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from app import settings as app_settings
+from losb import checks
+from losb.api.v1 import exceptions
+from losb.api.v1.services.city_catalogue import CityCatalogue
+from losb.api.v1.services.city_nearest import EARTH_RADIUS_KM, CityKDTree
+from losb.api.v1.services.city_search import CityIndex
+from losb.api.v1.services.http import PooledHttpClient
+from losb.api.v1.services.idempotency import IdempotentRequests
+from losb.api.v1.services.maintenance import purge_expired_verifications, purge_sms_outbox
+from losb.api.v1.services.otp_store import CacheOtpStore, ModelOtpStore, otp_store
+from losb.api.v1.services.phone_numbers import InvalidPhoneNumber, PhoneNumber, parse_phone
+from losb.api.v1.services.profile_cache import profile_cache
+from losb.api.v1.services.rate_limit import CacheBackend, MemoryBackend, RateLimitThrottle, SlidingWindow, TokenBucket
+from losb.api.v1.services.sms_outbox import SmsOutboxService
+from losb.api.v1.services.sms_router import ProviderHealth, SmsRouter
+from losb.api.v1.services.sms_sender import FakeSmsService, SmsRuService
+from losb.api.v1.services.sms_verification import SmsVerificationService
+from losb.api.v1.services.user_cache import UserCache, user_cache
+from losb.api.v1.services.user_lookup import iter_profiles
+from losb.api.v1.services.user_filter import KnownUsersFilter
+from losb.db_connections import connection_metrics
+from losb.db_router import primary_pins, replica_pool
+from losb.models import City, CityChange, Phone, SMSVerification, SmsDeliveryReport, SmsOutbox, User
+
+REPLICAS = [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        self.cache = UserCache(ttl=60, max_size=2)
+
+    def put(self, telegram_id, **fields):
+        user = User(telegram_id=telegram_id, name='', **fields)
+        self.cache.set(telegram_id, user, self.cache.generation)
+        return user
+
+    def test_least_recently_used_entry_is_evicted(self):
+        for telegram_id in ('a', 'b'):
+            self.put(telegram_id)
+        self.cache.get('a')
+        self.put('c')
+        self.assertEqual([key for key in 'abc' if self.cache.get(key) is not None], ['a', 'c'])
+
+    def test_entries_expire(self):
+        self.put('a')
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(self.cache.get('a'))
+
+    def test_callers_get_copies(self):
+        self.put('a')
+        self.cache.get('a').name = 'changed'
+        self.assertEqual(self.cache.get('a').name, '')
+
+    def test_row_loaded_before_an_invalidation_is_not_cached(self):
+        generation = self.cache.generation
+        self.cache.invalidate('a')
+        self.cache.set('a', User(telegram_id='a'), generation)
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_entry_of_another_profile_version_is_not_served(self):
+        self.cache.set('a', User(telegram_id='a'), self.cache.generation, version=1)
+        self.assertIsNotNone(self.cache.get('a', version=1))
+        self.assertIsNone(self.cache.get('a', version=2))
+
+    def test_city_changes_drop_its_residents(self):
+        self.put('a', location_id=1)
+        self.put('b', location_id=2)
+        self.cache.invalidate_related('location_id', 1)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+
+    def test_saving_a_user_invalidates_the_process_cache(self):
+        user = User.objects.create(telegram_id='cached', name='')
+        user_cache.set('cached', user, user_cache.generation)
+        self.assertIsNotNone(user_cache.get('cached'))
+        user.name = 'renamed'
+        user.save()
+        self.assertIsNone(user_cache.get('cached'))
+
+
+class KnownUsersFilterTests(TestCase):
+    def setUp(self):
+        caches['default'].delete(KnownUsersFilter.SNAPSHOT_KEY)
+        self.addCleanup(caches['default'].delete, KnownUsersFilter.SNAPSHOT_KEY)
+        User.objects.create(telegram_id='known', name='')
+        self.filter = KnownUsersFilter(alias='default', false_positive_rate=0.01)
+
+    def test_tokens_pass_until_the_filter_is_built(self):
+        self.assertTrue(self.filter.might_exist('nobody'))
+        self.filter.warm_up()
+        self.assertTrue(self.filter.might_exist('known'))
+        self.assertFalse(self.filter.might_exist('nobody'))
+
+    def test_miss_is_answered_without_the_database(self):
+        self.filter.rebuild()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.filter.might_exist('nobody'))
+
+    def test_workers_load_the_published_filter(self):
+        self.filter.rebuild()
+        worker = KnownUsersFilter(alias='default', false_positive_rate=0.01)
+        with self.assertNumQueries(0):
+            worker.warm_up()
+            self.assertTrue(worker.might_exist('known'))
+
+    def test_announced_user_is_pulled_in_on_the_next_miss(self):
+        self.filter.warm_up()
+        # bulk_create sends no post_save, as with a user created by another process
+        User.objects.bulk_create([User(telegram_id='elsewhere', name='')])
+        self.filter.announce_created()
+        self.assertTrue(self.filter.might_exist('elsewhere'))
+
+
+class SmsVerificationFlowMixin:
+    store_class = None
+
+    def setUp(self):
+        self.user = User.objects.create(telegram_id='verify', name='')
+        self.store = self.store_class()
+        self.service = SmsVerificationService(self.user, store=self.store)
+
+    def tearDown(self):
+        self.store.delete(self.user)
+
+    def test_right_code_sets_phone(self):
+        otp = self.service.request_verification(code='7', number='8 912 345-67-89')
+        self.assertEqual(SmsOutbox.objects.get().phone, '+79123456789')
+
+        self.assertEqual(self.service.verify_code(otp, '7', '9123456789'), {'code': '7', 'number': '9123456789'})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.phone_e164, '+79123456789')
+        # the previous release still reads the Phone row during the rollout
+        self.assertEqual((self.user.phone.number, self.user.phone.e164), ('9123456789', '+79123456789'))
+        with self.assertRaises(exceptions.SmsVerificationNotSend):
+            self.service.verify_code(otp, '7', '9123456789')
+
+    def test_wrong_codes_use_up_attempts(self):
+        otp = self.service.request_verification(code='7', number='9123456789')
+        wrong = '0' * len(otp)
+        for _ in range(settings.SMS_VERIFICATION_ATTEMPTS):
+            with self.assertRaises(exceptions.SmsVerificationFailed):
+                self.service.verify_code(wrong, '7', '9123456789')
+        with self.assertRaises(exceptions.SmsVerificationAttemptsExceeded):
+            self.service.verify_code(otp, '7', '9123456789')
+
+    def test_resend_cooldown(self):
+        self.service.request_verification(code='7', number='9123456789')
+        with self.assertRaises(exceptions.SmsVerificationResendCooldown):
+            self.service.request_verification(code='7', number='9123456789')
+
+    def test_number_of_another_user_is_refused(self):
+        User.objects.create(telegram_id='owner', name='', phone_number='9123456789', phone_e164='+79123456789')
+        with self.assertRaises(exceptions.PhoneAlreadyInUse):
+            self.service.request_verification(code='7', number='9123456789')
+
+
+class ModelOtpStoreFlowTests(SmsVerificationFlowMixin, TestCase):
+    store_class = ModelOtpStore
+
+
+class CacheOtpStoreFlowTests(SmsVerificationFlowMixin, TestCase):
+    store_class = CacheOtpStore
+
+
+class IdempotentVerificationRequestTests(TestCase):
+    def setUp(self):
+        caches[settings.IDEMPOTENCY_CACHE_ALIAS].clear()
+        self.user = User.objects.create(telegram_id='retrying', name='')
+        self.addCleanup(otp_store.delete, self.user)
+        self.client = APIClient()
+        token = jwt.encode({'telegram_id': 'retrying'}, settings.SECRET_KEY, algorithm='HS256')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def post(self, number='9123456789', key='retry-1'):
+        return self.client.post(
+            reverse('losb:user-phone'), {'code': '7', 'number': number},
+            format='json', headers={'Idempotency-Key': key},
+        )
+
+    def test_repeated_key_replays_the_first_response(self):
+        first, second = self.post(), self.post()
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(SmsOutbox.objects.count(), 1)
+
+    def test_key_reused_for_another_number_is_rejected(self):
+        self.post()
+        self.assertEqual(self.post(number='9123456780').status_code, 422)
+        self.assertEqual(SmsOutbox.objects.count(), 1)
+
+    def test_duplicate_of_a_request_in_flight_gives_up_with_409(self):
+        requests = IdempotentRequests(alias=settings.IDEMPOTENCY_CACHE_ALIAS, ttl=60, lock_timeout=5, wait=0)
+        with mock.patch('losb.api.v1.views.idempotent_requests', requests):
+            # the first request claims the key and is still running when the duplicate arrives
+            with mock.patch.object(requests, '_run', side_effect=lambda *args: self.post()):
+                response = self.post()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(SmsOutbox.objects.count(), 0)
+
+    def test_waiting_for_a_vanished_entry_sleeps_between_polls(self):
+        cache = mock.Mock(**{'get.return_value': None, 'add.return_value': False})
+        requests = IdempotentRequests(alias='default', ttl=60, lock_timeout=5, wait=0.05, poll_interval=0.01)
+        request = SimpleNamespace(
+            headers={'Idempotency-Key': 'lost'}, user=SimpleNamespace(pk=1), method='POST', path='/', data={},
+        )
+        with mock.patch.object(IdempotentRequests, 'cache', cache), mock.patch('time.sleep') as sleep:
+            with self.assertRaises(exceptions.IdempotentRequestInProgress):
+                requests.respond(request, handler=mock.Mock())
+        self.assertGreater(sleep.call_count, 0)
+
+
+class SmsRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.flaky = FakeSmsService(name='flaky', latency=0, error_rate=1)
+        self.spare = FakeSmsService(name='spare', latency=0, error_rate=0)
+        self.router = SmsRouter([self.flaky, self.spare], min_calls=1, failure_rate=0.5, cooldown=0.05)
+
+    def test_fails_over_and_opens_breaker(self):
+        self.assertEqual(self.router.send_sms('+79123456789', 'code')['provider'], 'spare')
+        self.assertEqual(self.router.stats()['flaky']['state'], ProviderHealth.OPEN)
+        self.assertEqual(self.router.ranked(), [self.spare])
+
+    def test_ranking_does_not_take_probe(self):
+        self.router.send_sms('+79123456789', 'code')
+        time.sleep(0.06)
+        for _ in range(3):
+            self.assertIn(self.flaky, self.router.ranked())
+        self.assertEqual(self.router.stats()['flaky']['state'], ProviderHealth.OPEN)
+
+        self.flaky.error_rate, self.spare.error_rate = 0, 1
+        self.assertEqual(self.router.send_sms('+79123456789', 'code')['provider'], 'flaky')
+        self.assertEqual(self.router.stats()['flaky']['state'], ProviderHealth.CLOSED)
+
+    def test_probe_that_never_reports_times_out(self):
+        health = ProviderHealth(window=60, min_calls=1, failure_rate=0.5, cooldown=0.05, probe_timeout=0.05)
+        health.record(False, 0)
+        time.sleep(0.06)
+        self.assertTrue(health.acquire())
+        self.assertFalse(health.acquire())
+        self.assertFalse(health.is_available())
+        time.sleep(0.06)
+        self.assertTrue(health.is_available())
+        self.assertTrue(health.acquire())
+
+    def test_late_failures_do_not_extend_the_cooldown(self):
+        health = ProviderHealth(window=60, min_calls=1, failure_rate=0.5, cooldown=0.05)
+        health.record(False, 0)
+        opened_at = health.opened_at
+        time.sleep(0.03)
+        health.record(False, 0)
+        self.assertEqual(health.opened_at, opened_at)
+        time.sleep(0.03)
+        self.assertTrue(health.is_available())
+
+    def test_released_probe_can_be_taken_again(self):
+        health = ProviderHealth(window=60, min_calls=1, failure_rate=0.5, cooldown=0.05)
+        health.record(False, 0)
+        time.sleep(0.06)
+        self.assertTrue(health.acquire())
+        health.release()
+        self.assertEqual(health.state, ProviderHealth.OPEN)
+        self.assertTrue(health.acquire())
+
+
+class RateLimitKeyTests(SimpleTestCase):
+    def ip_of(self, **headers):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.2', **headers)
+        return RateLimitThrottle().get_key(Request(request), 'ip')
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        self.assertEqual(self.ip_of(HTTP_X_FORWARDED_FOR='1.2.3.4'), '10.0.0.2')
+
+    def test_phone_key_is_the_normalised_number(self):
+        request = RequestFactory().post(
+            '/', {'phone': {'code': '7', 'number': '8 (912) 345-67-89'}}, content_type='application/json',
+        )
+        self.assertEqual(RateLimitThrottle().get_key(Request(request, parsers=[JSONParser()]), 'phone'), '+79123456789')
+
+    def test_invalid_phone_is_not_a_key(self):
+        request = RequestFactory().post('/', {'phone': {'code': '7', 'number': '12'}}, content_type='application/json')
+        self.assertIsNone(RateLimitThrottle().get_key(Request(request, parsers=[JSONParser()]), 'phone'))
+
+    def test_only_proxy_appended_hop_is_trusted(self):
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            self.assertEqual(self.ip_of(HTTP_X_FORWARDED_FOR='1.2.3.4, 5.6.7.8'), '5.6.7.8')
+
+
+class SmsOutboxTests(TestCase):
+    def setUp(self):
+        self.outbox = SmsOutboxService(max_attempts=2, backoff=0, send_timeout=30)
+
+    def test_lease_covers_every_round_of_the_batch(self):
+        self.outbox.enqueue('+79123456789', 'code')
+        before = timezone.now()
+        self.outbox.claim(batch_size=20, concurrency=4)
+        self.assertGreaterEqual(SmsOutbox.objects.get().next_attempt_at, before + timedelta(seconds=150))
+
+    def test_stale_claim_cannot_settle(self):
+        self.outbox.enqueue('+79123456789', 'code')
+        [stale] = self.outbox.claim(batch_size=1)
+        SmsOutbox.objects.update(next_attempt_at=timezone.now())  # the lease ran out
+        [current] = self.outbox.claim(batch_size=1)
+
+        self.assertFalse(self.outbox.mark_failed(stale, 'timeout'))
+        self.assertTrue(self.outbox.mark_sent(current, 'id-1'))
+        row = SmsOutbox.objects.get()
+        self.assertEqual((row.status, row.attempts, row.provider_message_id), (SmsOutbox.Status.SENT, 1, 'id-1'))
+        self.assertFalse(self.outbox.mark_sent(current, 'id-2'))
+
+    def test_expired_rows_are_not_sent(self):
+        self.outbox.enqueue('+79123456789', 'old code', expires_at=timezone.now())
+        fresh = self.outbox.enqueue('+79123456789', 'new code', expires_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual([row.pk for row in self.outbox.claim(batch_size=10)], [fresh.pk])
+        self.assertEqual(SmsOutbox.objects.get(message='old code').status, SmsOutbox.Status.DEAD)
+
+    def test_purge_deletes_settled_rows_only(self):
+        for status in SmsOutbox.Status:
+            SmsOutbox.objects.create(phone='+79123456789', message=status, status=status)
+        SmsOutbox.objects.update(updated_at=timezone.now() - timedelta(seconds=settings.SMS_OUTBOX_RETENTION + 1))
+        self.assertEqual(purge_sms_outbox(budget=10, batch_size=1), 2)
+        self.assertCountEqual(
+            SmsOutbox.objects.values_list('status', flat=True),
+            [SmsOutbox.Status.PENDING, SmsOutbox.Status.SENDING],
+        )
+
+
+class SmsDeliveryCallbackTests(TestCase):
+    def setUp(self):
+        # the view reads app.settings directly, override_settings does not reach it
+        patcher = mock.patch('losb.api.v1.views.settings.SMS_RU_CALLBACK_TOKEN', 'callback-secret')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        caches[settings.IDEMPOTENCY_CACHE_ALIAS].clear()
+        self.user = User.objects.create(telegram_id='delivery', name='')
+        self.addCleanup(otp_store.delete, self.user)
+        self.client = APIClient()
+        token = jwt.encode({'telegram_id': 'delivery'}, settings.SECRET_KEY, algorithm='HS256')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def callback(self, *entries, token='callback-secret'):
+        return self.client.post(f"{reverse('losb:sms-callback')}?token={token}", {'data[]': list(entries)})
+
+    def test_wrong_token_is_refused(self):
+        self.assertEqual(self.callback('sms_status\nid-1\n103\n1700000000', token='guess').status_code, 403)
+        self.assertFalse(SmsDeliveryReport.objects.exists())
+
+    def test_latest_report_wins_and_junk_is_skipped(self):
+        response = self.callback(
+            'sms_status\nid-1\n102\n1700000000',
+            'sms_status\nid-1\n103\n1700000005',
+            'callback_check\n1700000000',
+            'sms_status\nid-2\nnot-a-code',
+        )
+        self.assertEqual(response.content, b'100')
+        reports = SmsDeliveryReport.objects.values_list('provider_message_id', 'status_code')
+        self.assertEqual(list(reports), [('id-1', 103)])
+
+        # sms.ru repeats callbacks, a report for a known message updates it in place
+        self.callback('sms_status\nid-1\n106\n1700000010')
+        self.assertEqual(SmsDeliveryReport.objects.get().status_code, 106)
+
+    def test_delivery_status_follows_the_outbox_and_the_report(self):
+        self.client.post(reverse('losb:user-phone'), {'code': '7', 'number': '9123456789'}, format='json')
+        self.assertEqual(self.client.get(reverse('losb:user-phone')).json()['status'], SmsOutbox.Status.PENDING)
+
+        worker = importlib.import_module('losb.management.commands.sms-outbox-worker')
+        with mock.patch.object(worker, 'get_sms_sender', return_value=FakeSmsService(latency=0, error_rate=0)):
+            call_command('sms-outbox-worker', '--once', stdout=io.StringIO())
+        outbox = SmsOutbox.objects.get()
+        self.assertEqual(outbox.status, SmsOutbox.Status.SENT)
+
+        self.callback(f'sms_status\n{outbox.provider_message_id}\n103\n1700000000')
+        status = self.client.get(reverse('losb:user-phone')).json()
+        self.assertEqual((status['status'], status['delivery_status']), (SmsOutbox.Status.SENT, 'delivered'))
+
+
+class ProfileEndpointsTests(TestCase):
+    def setUp(self):
+        caches[settings.PROFILE_CACHE_ALIAS].clear()
+        User.objects.create(telegram_id='avatar', name='', avatar_url='user/avatar/me.png')
+        self.client = APIClient()
+        token = jwt.encode({'telegram_id': 'avatar'}, settings.SECRET_KEY, algorithm='HS256')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_bootstrap_and_profile_share_the_cached_payload(self):
+        bootstrap = self.client.get('/api/v1/losb/bootstrap').json()['user']
+        profile = self.client.get('/api/v1/losb/user').json()
+        self.assertEqual(bootstrap, profile)
+        self.assertTrue(profile['avatar'].startswith('http://testserver/'))
+
+    def test_only_the_profile_projection_joins_the_city(self):
+        User.objects.filter(telegram_id='avatar').update(location=City.objects.create(name='Samara'))
+        with CaptureQueriesContext(connections['default']) as queries:
+            User.objects.get(telegram_id='avatar')
+        self.assertNotIn('JOIN', queries[0]['sql'])
+        with self.assertNumQueries(1):
+            self.assertEqual(User.objects.projected('profile').get(telegram_id='avatar').location.name, 'Samara')
+
+
+# the per-user limit would answer most of the burst with 429, the target is the OTP check behind it
+@override_settings(RATE_LIMITS={**settings.RATE_LIMITS, 'otp-verify-user': 'bucket:1000/s'})
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class ConcurrentOtpGuessTests(TransactionTestCase):
+    threads = 16
+
+    def setUp(self):
+        self.user = User.objects.create(telegram_id='hammer', name='')
+        self.token = jwt.encode({'telegram_id': self.user.telegram_id}, settings.SECRET_KEY, algorithm='HS256')
+        self.phone = {'code': '7', 'number': '9990000001'}
+        self.otp = SmsVerificationService(self.user).request_verification(**self.phone)
+
+    def tearDown(self):
+        otp_store.delete(self.user)
+
+    def hammer(self, guess: str) -> Counter:
+        barrier = threading.Barrier(self.threads)
+
+        def attempt(_):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+            try:
+                barrier.wait()
+                response = client.put(reverse('losb:user-phone'), {'otp': guess, 'phone': self.phone}, format='json')
+                if response.status_code == 200:
+                    return 'ok'
+                return response.data['errors'][0]['detail']
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            return Counter(executor.map(attempt, range(self.threads)))
+
+    def test_wrong_guesses_stop_at_the_attempt_limit(self):
+        results = self.hammer('0' * len(self.otp))
+        self.assertEqual(results, {
+            exceptions.SmsVerificationFailed.default_detail: settings.SMS_VERIFICATION_ATTEMPTS,
+            exceptions.SmsVerificationAttemptsExceeded.default_detail: self.threads - settings.SMS_VERIFICATION_ATTEMPTS,
+        })
+
+    def test_right_guess_succeeds_once(self):
+        results = self.hammer(self.otp)
+        self.assertEqual(results['ok'], 1)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers with the next status of ``server.script``; ``'hang'`` waits past the client read timeout.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.server.connections.add(self.client_address)
+        status = self.server.script.pop(0) if self.server.script else 200
+        if status == 'hang':
+            # the client has given up by then
+            time.sleep(0.5)
+            return
+        body = b'{"status": "OK"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledHttpClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.script = []
+        self.server.requests = 0
+        self.server.connections = set()
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/sms/send'
+        self.client = PooledHttpClient(pool_size=2, connect_timeout=0.5, read_timeout=0.2, max_retries=2, backoff=0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_server_errors_are_retried(self):
+        self.server.script = [502, 503]
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+        metrics = self.client.metrics.snapshot()
+        self.assertEqual((metrics['attempts'], metrics['failures'], metrics['retries']), (3, 2, 2))
+
+    def test_last_server_error_is_returned(self):
+        self.server.script = [500, 500, 500, 500]
+        self.assertEqual(self.client.get(self.url).status_code, 500)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(self.client.metrics.snapshot()['retries'], 2)
+
+    def test_read_timeout_is_not_retried(self):
+        self.server.script = ['hang']
+        with self.assertRaises(requests.ReadTimeout):
+            self.client.get(self.url)
+        self.assertEqual(self.server.requests, 1)
+        metrics = self.client.metrics.snapshot()
+        self.assertEqual((metrics['attempts'], metrics['failures'], metrics['retries']), (1, 1, 0))
+
+    def test_connect_errors_are_retried(self):
+        with socket.socket() as closed:
+            closed.bind(('127.0.0.1', 0))
+            port = closed.getsockname()[1]
+        with self.assertRaises(requests.ConnectionError):
+            self.client.get(f'http://127.0.0.1:{port}/sms/send')
+        metrics = self.client.metrics.snapshot()
+        self.assertEqual((metrics['attempts'], metrics['failures'], metrics['retries']), (3, 3, 2))
+
+    def test_sms_ru_fails_after_server_errors(self):
+        self.server.script = [500, 500, 500]
+        service = SmsRuService()
+        service.client, service.BASE_URL = self.client, self.url
+        with self.assertRaises(exceptions.SmsDeliveryError):
+            service.send_sms('+79123456789', 'code')
+        self.assertEqual(self.server.requests, 3)
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.client.get(self.url)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.server.connections), 1)
+
+
+@skipUnless(REPLICAS, 'needs a replica_* database, mirroring default in tests')
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {'default', *REPLICAS}
+
+    def setUp(self):
+        caches[settings.PROFILE_CACHE_ALIAS].clear()
+        user_cache.invalidate('reader')
+        primary_pins.cache.delete(primary_pins._key('reader'))
+        replica_pool._health = {alias: (True, float('-inf')) for alias in replica_pool.aliases}
+        User.objects.create(telegram_id='reader', name='')
+        self.client = APIClient()
+        token = jwt.encode({'telegram_id': 'reader'}, settings.SECRET_KEY, algorithm='HS256')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def queries_per_alias(self, method: str, path: str, **kwargs) -> dict:
+        contexts = {alias: CaptureQueriesContext(connections[alias]) for alias in self.databases}
+        for context in contexts.values():
+            context.__enter__()
+        try:
+            response = getattr(self.client, method)(path, **kwargs)
+        finally:
+            for context in contexts.values():
+                context.__exit__(None, None, None)
+        self.assertLess(response.status_code, 400)
+        return {alias: len(context) for alias, context in contexts.items()}
+
+    def replica_reads(self, queries: dict) -> int:
+        return sum(count for alias, count in queries.items() if alias != 'default')
+
+    def test_safe_requests_read_from_a_replica(self):
+        queries = self.queries_per_alias('get', '/api/v1/losb/user')
+        self.assertEqual(queries['default'], 0)
+        self.assertGreater(self.replica_reads(queries), 0)
+
+    def test_writes_pin_the_user_to_the_primary(self):
+        queries = self.queries_per_alias('put', '/api/v1/losb/user/name', data={'name': 'new'}, format='json')
+        self.assertEqual(self.replica_reads(queries), 0)
+
+        queries = self.queries_per_alias('get', '/api/v1/losb/user')
+        self.assertEqual(self.replica_reads(queries), 0)
+        self.assertGreater(queries['default'], 0)
+
+    def test_unhealthy_replicas_fall_back_to_the_primary(self):
+        replica_pool._health = {alias: (False, time.monotonic()) for alias in replica_pool.aliases}
+        queries = self.queries_per_alias('get', '/api/v1/losb/user')
+        self.assertEqual(self.replica_reads(queries), 0)
+
+
+class ConnectionMetricsTests(TestCase):
+    def test_new_connections_are_counted_per_alias(self):
+        before = connection_metrics.stats()
+        self.assertFalse(before['pooled'])
+
+        def connect():
+            try:
+                connections['default'].ensure_connection()
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=connect)
+        thread.start()
+        thread.join()
+        self.assertEqual(connection_metrics.stats()['connects'], before['connects'] + 1)
+
+    def test_pool_statistics_are_reported(self):
+        pool = mock.Mock(max_size=8, **{'get_stats.return_value': {
+            'pool_size': 6, 'pool_available': 2, 'requests_waiting': 1, 'requests_wait_ms': 40,
+        }})
+        with mock.patch('losb.db_connections.is_pooled', return_value=True), \
+                mock.patch.object(connections['default'], 'pool', pool, create=True):
+            stats = connection_metrics.stats()
+        self.assertEqual(
+            {key: stats[key] for key in ('pool_size', 'in_use', 'saturation', 'waiting', 'wait_ms', 'timeouts')},
+            {'pool_size': 6, 'in_use': 4, 'saturation': 0.5, 'waiting': 1, 'wait_ms': 40, 'timeouts': 0},
+        )
+
+    def test_pool_replaces_persistent_connections_on_postgresql(self):
+        postgres = {'ENGINE': 'django.db.backends.postgresql', 'OPTIONS': {'sslmode': 'require'}}
+        with mock.patch.object(app_settings, 'DATABASE_POOL', {'max_size': 4}):
+            pooled = app_settings.with_connection_reuse(postgres)
+            sqlite = app_settings.with_connection_reuse({'ENGINE': 'django.db.backends.sqlite3'})
+        self.assertEqual(pooled['CONN_MAX_AGE'], 0)
+        self.assertEqual(pooled['OPTIONS'], {'sslmode': 'require', 'pool': {'max_size': 4}})
+        self.assertEqual(sqlite['CONN_MAX_AGE'], app_settings.DATABASE_CONN_MAX_AGE)
+        self.assertTrue(sqlite['CONN_HEALTH_CHECKS'])
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class BenchDbConnectionsTests(TransactionTestCase):
+    def test_persistent_connections_connect_once_per_thread(self):
+        out = io.StringIO()
+        call_command('bench-db-connections', '--mode', 'none', '--mode', 'persistent',
+                     '--threads', '2', '--requests', '20', stdout=out)
+        none, persistent = out.getvalue().splitlines()
+        self.assertIn('20 connects', none)
+        self.assertIn('2 connects', persistent)
+        self.assertFalse(User.objects.exists())
+
+
+class ProvisionTests(TestCase):
+    def test_reports_created_and_existing_ids(self):
+        existing = User.objects.create_user('provisioned-1', None, name='kept')
+        created, found = User.objects.provision(['provisioned-1', 'provisioned-2', 'provisioned-2', 3], batch_size=2)
+        self.assertEqual((created, found), (['provisioned-2', '3'], ['provisioned-1']))
+
+        existing_row = User.objects.get(telegram_id='provisioned-1')
+        self.assertEqual((existing_row.name, existing_row.password), ('kept', existing.password))
+        self.assertFalse(User.objects.get(telegram_id='3').has_usable_password())
+
+    def test_second_call_creates_nothing(self):
+        User.objects.provision(['again'])
+        self.assertEqual(User.objects.provision(['again']), ([], ['again']))
+
+    def test_every_user_gets_a_phone_row(self):
+        # the previous release reads user.phone
+        User.objects.create_user('single', None, name='')
+        User.objects.provision(['bulk-1', 'bulk-2', 'single'], batch_size=2)
+        phones = dict(User.objects.values_list('telegram_id', 'phone__code'))
+        self.assertEqual(phones, {'single': '7', 'bulk-1': '7', 'bulk-2': '7'})
+        self.assertEqual(Phone.objects.count(), 3)
+
+
+@mock.patch('losb.api.v1.services.auth.INTERNAL_SERVICE_TOKEN', 'svc')
+class UserLookupTests(TestCase):
+    url = '/api/v1/losb/internal/users/profiles'
+
+    def setUp(self):
+        for telegram_id in ('lookup-1', 'lookup-2', 'lookup-3'):
+            User.objects.create(telegram_id=telegram_id, name=telegram_id)
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_SERVICE_TOKEN='svc')
+
+    def test_requires_the_service_token(self):
+        client = APIClient()
+        self.assertEqual(client.post(self.url, {'telegram_ids': ['lookup-1']}, format='json').status_code, 403)
+        client.credentials(HTTP_X_SERVICE_TOKEN='wrong')
+        self.assertEqual(client.post(self.url, {'telegram_ids': ['lookup-1']}, format='json').status_code, 403)
+
+    def test_profiles_follow_the_request_order(self):
+        ids = ['lookup-3', 'unknown', 'lookup-1', 'lookup-3']
+        response = self.client.post(self.url, {'telegram_ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([profile['name'] for profile in response.json()], ['lookup-3', 'lookup-1'])
+
+    def test_rejects_an_empty_batch(self):
+        self.assertEqual(self.client.post(self.url, {'telegram_ids': []}, format='json').status_code, 400)
+
+    def test_streams_json_lines(self):
+        response = self.client.post(
+            self.url, {'telegram_ids': ['lookup-2', 'lookup-1']}, format='json', HTTP_ACCEPT='application/x-ndjson',
+        )
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['lookup-2', 'lookup-1'])
+
+    def test_one_query_per_chunk(self):
+        with self.assertNumQueries(2):
+            chunks = list(iter_profiles(['lookup-1', 'lookup-2', 'unknown'], chunk_size=2))
+        self.assertEqual([[user.telegram_id for user in users] for users in chunks], [['lookup-1', 'lookup-2'], []])
+
+
+class ParsePhoneTests(SimpleTestCase):
+    def test_typed_forms_of_a_number_normalise_alike(self):
+        for code, number in [
+            ('7', '9123456789'), ('+7', '(912) 345-67-89'), ('7', '8 912 345 67 89'), ('7', '79123456789'),
+        ]:
+            self.assertEqual(parse_phone(code, number).e164, '+79123456789')
+        self.assertEqual(parse_phone('375', '80291234567'), PhoneNumber('375', '291234567'))
+
+    def test_invalid_numbers_are_refused(self):
+        for code, number in [('7', '12345'), ('7', '９１２３４５６７８９'), ('999', '9123456789'), ('7', None)]:
+            with self.assertRaises(InvalidPhoneNumber):
+                parse_phone(code, number)
+
+
+class PhoneMigrationTests(TestCase):
+    def test_phones_are_copied_onto_users(self):
+        copy_phones = importlib.import_module('losb.migrations.0031_copy_phones_to_users').copy_phones
+        verified = Phone.objects.create(code='7', number='9123456789', e164='+79123456789')
+        User.objects.create(telegram_id='verified', name='', phone=verified)
+        User.objects.create(telegram_id='unverified', name='', phone=Phone.objects.create(code='7'))
+        User.objects.create(telegram_id='phoneless', name='', phone_code='375')
+
+        copy_phones(django_apps, SimpleNamespace(connection=connections['default']))
+
+        self.assertEqual(
+            {telegram_id: phone for telegram_id, *phone in
+             User.objects.values_list('telegram_id', 'phone_code', 'phone_number', 'phone_e164')},
+            {
+                'verified': ['7', '9123456789', '+79123456789'],
+                'unverified': ['7', None, None],
+                'phoneless': ['375', None, None],
+            },
+        )
+
+    def test_backfill_fills_valid_unique_numbers_only(self):
+        backfill_e164 = importlib.import_module('losb.migrations.0029_backfill_phone_e164').backfill_e164
+        verified = Phone.objects.create(code='7', number='9123456789', e164='+79123456789')
+        typed = Phone.objects.create(code='7', number='8 (999) 000-00-01')
+        duplicate = Phone.objects.create(code='7', number='89990000001')
+        invalid = Phone.objects.create(code='7', number='12345')
+        again = Phone.objects.create(code='7', number='9123456789')
+
+        with self.assertNumQueries(4):
+            # existing numbers, one batch read, its UPDATE and the empty read that ends the loop
+            backfill_e164(django_apps, SimpleNamespace(connection=connections['default']))
+
+        self.assertEqual(
+            dict(Phone.objects.values_list('pk', 'e164')),
+            {
+                verified.pk: '+79123456789', typed.pk: '+79990000001',
+                duplicate.pk: None, invalid.pk: None, again.pk: None,
+            },
+        )
+
+    def test_profile_reads_the_phone_from_the_user(self):
+        # a stale Phone row must not leak into the profile
+        phone = Phone.objects.create(code='7', number='9000000000', e164='+79000000000')
+        User.objects.create(
+            telegram_id='reader', name='', phone=phone,
+            phone_code='7', phone_number='9123456789', phone_e164='+79123456789',
+        )
+        caches[settings.PROFILE_CACHE_ALIAS].clear()
+        token = jwt.encode({'telegram_id': 'reader'}, settings.SECRET_KEY, algorithm='HS256')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(client.get('/api/v1/losb/user').json()['phone'], {'code': '7', 'number': '9123456789'})
+
+
+class PurgeExpiredVerificationsTests(TestCase):
+    def test_expired_verifications_are_deleted_and_unlinked(self):
+        expired, fresh = SMSVerification.objects.create(otp='1111'), SMSVerification.objects.create(otp='2222')
+        SMSVerification.objects.filter(pk=expired.pk).update(
+            created_at=timezone.now() - timedelta(seconds=settings.SMS_VERIFICATION_TTL + 1),
+        )
+        User.objects.create(telegram_id='expired', name='', sms_verification=expired)
+        outbox = SmsOutbox.objects.create(phone='+79123456789', message='1111', verification=expired)
+        version = profile_cache.get_version('expired')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(purge_expired_verifications(budget=10, batch_size=10), 1)
+
+        self.assertEqual(list(SMSVerification.objects.values_list('pk', flat=True)), [fresh.pk])
+        self.assertIsNone(User.objects.get(telegram_id='expired').sms_verification_id)
+        outbox.refresh_from_db()
+        self.assertIsNone(outbox.verification_id)
+        self.assertNotEqual(profile_cache.get_version('expired'), version)
+
+
+class PopulateCitiesTests(TestCase):
+    def populate(self, rows, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+            f.write(''.join(f'{row}\n' for row in rows))
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command('populate-cities', '--file', f.name, '--column', '0', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_import_is_idempotent_and_logs_new_names_only(self):
+        City.objects.create(name='Kazan')
+        rows = ['Kazan,55.79,49.12', 'Tver,56.86,35.9', ' ,0,0', 'Tver,56.86,35.9', 'Omsk,54.98,73.37']
+        self.populate(rows, '--lat-column', '1', '--lon-column', '2')
+        self.assertEqual(sorted(City.objects.values_list('name', flat=True)), ['Kazan', 'Omsk', 'Tver'])
+        self.assertEqual(
+            sorted(CityChange.objects.filter(action=CityChange.Action.INSERT).values_list('name', flat=True)),
+            ['Kazan', 'Omsk', 'Tver'],
+        )
+        # Kazan was only given its coordinates
+        self.assertEqual(City.objects.filter(name='Kazan').values_list('latitude', 'longitude').get(), (55.79, 49.12))
+
+        changes = CityChange.objects.count()
+        self.assertIn('Inserted 0 cities', self.populate(rows, '--lat-column', '1', '--lon-column', '2'))
+        self.assertEqual(CityChange.objects.count(), changes)
+
+    def test_dry_run_writes_nothing(self):
+        self.assertIn('Would insert 2 cities', self.populate(['Tver', 'Omsk'], '--dry-run'))
+        self.assertFalse(City.objects.exists())
+
+    def test_coordinate_columns_come_in_pairs(self):
+        with self.assertRaises(CommandError):
+            self.populate(['Tver,56.86'], '--lat-column', '1')
+
+
+class CitySearchTests(TestCase):
+    def setUp(self):
+        names = ['Москва', 'Мосальск', 'Санкт-Петербург', 'Орёл', 'Нижний Новгород', 'Великий Новгород', 'Новосибирск']
+        self.index = CityIndex(enumerate(names, start=1))
+
+    def names(self, query, limit=10):
+        return [name for _, name in self.index.search(query, limit)]
+
+    def test_prefix_of_the_full_name_ranks_before_other_words(self):
+        self.assertEqual(self.names('мос'), ['Москва', 'Мосальск'])
+        self.assertEqual(self.names('нов'), ['Новосибирск', 'Нижний Новгород', 'Великий Новгород'])
+        self.assertEqual(self.names('Великий Новгород'), ['Великий Новгород'])
+
+    def test_latin_spellings_and_yo_match(self):
+        self.assertEqual(self.names('moskva'), ['Москва'])
+        self.assertEqual(self.names('Sankt Peterburg'), ['Санкт-Петербург'])
+        self.assertEqual(self.names('орел'), ['Орёл'])
+
+    def test_typos_fall_back_to_fuzzy_matches(self):
+        self.assertEqual(self.names('Масква'), ['Москва'])
+        self.assertEqual(self.names('qwerty'), [])
+
+    def test_limit(self):
+        self.assertEqual(len(self.names('мос', limit=1)), 1)
+
+    def test_endpoint_sees_new_cities(self):
+        User.objects.create(telegram_id='searcher', name='')
+        client = APIClient()
+        token = jwt.encode({'telegram_id': 'searcher'}, settings.SECRET_KEY, algorithm='HS256')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(client.get(reverse('losb:cities-search'), {'q': 'тверь'}).json(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            city = City.objects.create(name='Тверь')
+        self.assertEqual(
+            client.get(reverse('losb:cities-search'), {'q': 'тверь'}).json(), [{'id': city.pk, 'name': 'Тверь'}],
+        )
+
+    def test_bench_compares_the_index_with_icontains(self):
+        City.objects.bulk_create([City(name=name) for name in ('Казань', 'Калуга', 'Кемерово')])
+        out = io.StringIO()
+        call_command('bench-city-search', '--queries', '20', stdout=out)
+        labels = [line.split(':')[0].strip() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual(labels, ['index', 'icontains'])
+
+
+class CityNearestTests(TestCase):
+    @staticmethod
+    def haversine_km(latitude, longitude, other_latitude, other_longitude):
+        lat1, lon1, lat2, lon2 = map(math.radians, (latitude, longitude, other_latitude, other_longitude))
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+    def test_matches_a_linear_scan(self):
+        rng = random.Random(0)
+        cities = [(pk, str(pk), rng.uniform(-90, 90), rng.uniform(-180, 180)) for pk in range(500)]
+        tree = CityKDTree(cities)
+        for _ in range(50):
+            latitude, longitude = rng.uniform(-90, 90), rng.uniform(-180, 180)
+            expected = sorted(cities, key=lambda city: self.haversine_km(latitude, longitude, *city[2:]))[:3]
+            found = tree.nearest(latitude, longitude, k=3)
+            self.assertEqual([pk for pk, _, _ in found], [pk for pk, *_ in expected])
+            self.assertAlmostEqual(found[0][2], self.haversine_km(latitude, longitude, *expected[0][2:]), places=6)
+
+    def test_distance_wraps_around_the_antimeridian(self):
+        tree = CityKDTree([(1, 'Anadyr', 64.73, 177.5), (2, 'Nome', 64.5, -165.4), (3, 'Moscow', 55.75, 37.62)])
+        [(pk, _, distance)] = tree.nearest(64.6, -179.9)
+        self.assertEqual(pk, 1)
+        self.assertLess(distance, 200)
+
+    def test_empty_catalogue(self):
+        self.assertEqual(CityKDTree([]).nearest(0, 0), [])
+
+    def test_endpoint_skips_cities_without_coordinates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            City.objects.create(name='Nowhere')
+            kazan = City.objects.create(name='Kazan', latitude=55.79, longitude=49.12)
+        User.objects.create(telegram_id='traveller', name='')
+        client = APIClient()
+        token = jwt.encode({'telegram_id': 'traveller'}, settings.SECRET_KEY, algorithm='HS256')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        response = client.get(reverse('losb:cities-nearest'), {'lat': 55.8, 'lon': 49.1, 'limit': 5})
+        self.assertEqual([(city['id'], city['name']) for city in response.json()], [(kazan.pk, 'Kazan')])
+        self.assertEqual(client.get(reverse('losb:cities-nearest'), {'lat': 91, 'lon': 0}).status_code, 400)
+
+    def test_bench_reports_every_size(self):
+        out = io.StringIO()
+        call_command('bench-city-nearest', '--sizes', '10', '100', '--queries', '20', stdout=out)
+        self.assertEqual([line.split()[0] for line in out.getvalue().splitlines()], ['10', '100'])
+
+
+class CityCatalogueDeltaTests(TestCase):
+    def setUp(self):
+        self.catalogue = CityCatalogue(alias='default', max_delta=100, settle=30)
+
+    def delta(self, since: int) -> dict:
+        return json.loads(self.catalogue.delta_response(since).content)
+
+    def settle(self):
+        CityChange.objects.update(created_at=timezone.now() - timedelta(seconds=31))
+
+    def test_only_renames_are_logged(self):
+        city = City.objects.create(name='Moskva')
+        city.save()
+        city.name = 'Moscow'
+        city.save()
+        self.assertEqual(
+            list(CityChange.objects.order_by('id').values_list('action', 'name')),
+            [(CityChange.Action.INSERT, 'Moskva'), (CityChange.Action.RENAME, 'Moscow')],
+        )
+
+    def test_saving_a_loaded_city_does_not_read_it_again(self):
+        City.objects.create(name='Omsk')
+        city = City.objects.get(name='Omsk')
+        with self.assertNumQueries(1):
+            city.save()
+        self.assertEqual(CityChange.objects.count(), 1)
+
+    def test_changes_are_stamped_by_the_database_clock(self):
+        # a change written by a worker whose clock lags must not count as settled right away
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() - timedelta(hours=1)):
+            City.objects.create(name='Perm')
+        self.assertEqual(self.catalogue.get_dataset_version(), 0)
+
+    def test_recent_changes_wait_for_the_settle_window(self):
+        City.objects.create(name='Kazan')
+        self.settle()
+        version = self.catalogue.get_dataset_version()
+        # a change with a lower id could still be uncommitted next to this one
+        City.objects.create(name='Tver')
+        self.assertEqual(self.catalogue.get_dataset_version(), version)
+        self.assertEqual(self.delta(version), {'version': version, 'full': False, 'changes': []})
+
+        self.settle()
+        delta = self.delta(version)
+        self.assertGreater(delta['version'], version)
+        self.assertEqual([change['name'] for change in delta['changes']], ['Tver'])
+
+
+class CityCatalogueResponseTests(TestCase):
+    def setUp(self):
+        self.catalogue = CityCatalogue(alias='default', max_delta=100, settle=30)
+        self.factory = RequestFactory()
+        City.objects.create(name='Kazan')
+
+    def get(self, **headers):
+        return self.catalogue.response(self.factory.get('/', headers=headers))
+
+    def test_each_encoding_has_its_own_etag(self):
+        plain = self.get()
+        gzipped = self.get(accept_encoding='gzip')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertNotEqual(plain['ETag'], gzipped['ETag'])
+        for response in (plain, gzipped):
+            self.assertEqual(response['Vary'], 'Accept-Encoding, Authorization')
+
+    def test_not_modified_only_for_the_same_representation(self):
+        gzip_etag = self.get(accept_encoding='gzip')['ETag']
+
+        response = self.get(accept_encoding='gzip', if_none_match=gzip_etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], gzip_etag)
+        self.assertEqual(response['Vary'], 'Accept-Encoding, Authorization')
+
+        # a client that lost gzip support must not keep the compressed body
+        response = self.get(if_none_match=gzip_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(json.loads(response.content), [{'id': City.objects.get().id, 'name': 'Kazan'}])
+
+    def test_bootstrap_accepts_any_representation_etag(self):
+        snapshot = self.catalogue.get_snapshot()
+        self.assertTrue(snapshot.has_etag(self.get()['ETag']))
+        self.assertTrue(snapshot.has_etag(self.get(accept_encoding='gzip')['ETag']))
+        self.assertFalse(snapshot.has_etag('"stale"'))
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_process_local_otp_cache_is_reported(self):
+        with override_settings(DEBUG=False, SMS_VERIFICATION_CACHE_ALIAS='default'):
+            warnings = checks.check_shared_caches(None)
+        self.assertIn('SMS_VERIFICATION_CACHE_ALIAS', [warning.msg.split()[0] for warning in warnings])
+        self.assertEqual({warning.id for warning in warnings}, {'losb.W001'})
+
+
+class RateLimitAlgorithmTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_bucket_allows_a_burst_then_refills(self):
+        bucket = TokenBucket(limit=3, period=3)
+        backend = CacheBackend('default')
+        self.assertEqual([bucket.hit(backend, 'bucket', 100.0) for _ in range(3)], [None] * 3)
+        self.assertAlmostEqual(bucket.hit(backend, 'bucket', 100.0), 1.0)
+        self.assertIsNone(bucket.hit(backend, 'bucket', 101.0))
+
+    def test_bucket_holds_under_concurrency(self):
+        bucket = TokenBucket(limit=5, period=3600)
+        backend = CacheBackend('default', max_retries=1000)
+        barrier = threading.Barrier(20)
+
+        def hit(_):
+            barrier.wait()
+            return bucket.hit(backend, 'concurrent', 100.0) is None
+
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            self.assertEqual(sum(executor.map(hit, range(20))), 5)
+
+    def test_rejected_hits_are_not_counted(self):
+        for backend in (MemoryBackend(), CacheBackend('default')):
+            window = SlidingWindow(limit=2, period=60)
+            hits = [window.hit(backend, 'sliding', 30.0) for _ in range(5)]
+            self.assertEqual(hits[:2], [None, None])
+            self.assertTrue(all(wait is not None for wait in hits[2:]))
+            self.assertEqual(backend.get_many(['sliding:0'])['sliding:0'], 2)